@@ -0,0 +1,119 @@
+import os
+import sys
+import glob
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import budget_analyzer
+from instrumentation import StageTimer
+from budget_loader import load_budget, prune_cache
+
+def find_budgets(inputs):
+    """Expand directories and glob patterns into a sorted list of budget YAML files"""
+    paths = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for ext in ('*.yml', '*.yaml'):
+                paths.extend(glob.glob(os.path.join(entry, ext)))
+        else:
+            paths.extend(glob.glob(entry))
+    return sorted(set(paths))
+
+def shared_outputs(paths):
+    """Map each budget whose output directory would also be written by another budget to those budgets
+
+    The directory is named after the file stem, so a/smith.yml and b/Smith.yaml would overwrite
+    each other's reports.
+    """
+    by_dir = {}
+    for path in paths:
+        by_dir.setdefault(budget_analyzer.budget_name(path).replace(" ", "_").lower(), []).append(path)
+    return {path: [other for other in group if other != path]
+            for group in by_dir.values() if len(group) > 1 for path in group}
+
+def init_worker():
+    """Import the rendering stack and compile the report template once per worker
+
+    Kaleido is started by the worker's first PDF export, so a rerun of unchanged budgets never
+    launches Chrome.
+    """
+    import plotly.graph_objects
+    budget_analyzer.load_template()
+
+def analyze_file(path, output, timings=False, profile_dir=None, sankey_limits=None, plotlyjs="shared"):
+    """Analyze and render a single budget without any interactive steps"""
+    name = budget_analyzer.budget_name(path)
+    timer = StageTimer(name, profile=profile_dir is not None, profile_dir=profile_dir)
+    try:
+        with timer.stage("yaml_load"):
+            data = load_budget(path)
+        top_n, min_share = sankey_limits or (budget_analyzer.SANKEY_TOP_N, budget_analyzer.SANKEY_MIN_SHARE)
+        budget = budget_analyzer.MonthlyBudget(name, path, output, data,
+                                               timer=timer if timings or profile_dir else None,
+                                               sankey_top_n=top_n, sankey_min_share=min_share, plotlyjs=plotlyjs)
+        budget.render(output)
+    except Exception as e:
+        return {"input": path, "name": name, "status": "error",
+                "error": "{}: {}".format(type(e).__name__, e), "timings": timer.summary()}
+    return {"input": path, "name": name, "status": "ok", "dir": budget.dir, "timings": timer.summary()}
+
+def run_batch(paths, output="", workers=None, timings=False, profile_dir=None, sankey_limits=None,
+              plotlyjs="shared"):
+    """Analyze budgets across a process pool, yielding a status dict per file as it finishes
+
+    Budgets that would share an output directory are not analyzed and are reported as errors.
+    """
+    conflicts = shared_outputs(paths)
+    for path, others in conflicts.items():
+        yield {"input": path, "name": budget_analyzer.budget_name(path), "status": "error",
+               "error": "output directory shared with " + ", ".join(others), "timings": []}
+    paths = [path for path in paths if path not in conflicts]
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        futures = [pool.submit(analyze_file, path, output, timings, profile_dir, sankey_limits, plotlyjs) for path in paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', type=str, nargs='+', required=True,
+                        help="Directories or glob patterns of input YAML budget files")
+    parser.add_argument('-o', '--output', nargs='?', const="", type=str, default="",
+                        help="Output location for the per-budget report directories")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help="Number of worker processes (defaults to the CPU count)")
+    parser.add_argument('-t', '--timings', type=str, default=None,
+                        help="Append per-stage timing records of every budget as NDJSON to this file, with each stage's RSS change and the process's peak RSS; only --profile measures a stage's own peak memory")
+    parser.add_argument('-p', '--profile', type=str, default=None,
+                        help="Profile every stage with cProfile and tracemalloc, recording its peak traced memory and dumping .prof files to this directory")
+    parser.add_argument('--sankey-top-n', type=int, default=budget_analyzer.SANKEY_TOP_N,
+                        help="Line items kept per Sankey category, the rest are folded into an \"Other\" node")
+    parser.add_argument('--sankey-min-share', type=float, default=budget_analyzer.SANKEY_MIN_SHARE,
+                        help="Fold Sankey line items below this fraction of their category into an \"Other\" node")
+    parser.add_argument('--sankey-full', action='store_true',
+                        help="Draw every line item in the Sankey diagram")
+    parser.add_argument('--plotlyjs', type=str, default="shared", choices=budget_analyzer.PLOTLYJS_MODES,
+                        help="Share one plotly.js file in the output root, embed it in every Sankey HTML, or load it from the CDN")
+    args = parser.parse_args()
+    if args.sankey_full:
+        args.sankey_top_n = args.sankey_min_share = None
+
+    paths = find_budgets(args.input)
+    if not paths:
+        sys.exit("ERROR: No budget files found.")
+    # Drop the cached trees of budgets that have since been moved or deleted
+    prune_cache()
+    timings_file = open(args.timings, 'a') if args.timings else None
+    failed = 0
+    for result in run_batch(paths, args.output, args.workers, bool(args.timings), args.profile,
+                            (args.sankey_top_n, args.sankey_min_share), args.plotlyjs):
+        if timings_file:
+            for record in result["timings"]:
+                timings_file.write(json.dumps(record) + "\n")
+        if result["status"] == "ok":
+            print("OK: {} -> {}".format(result["input"], result["dir"]))
+        else:
+            failed += 1
+            print("ERROR: {} ({})".format(result["input"], result["error"]), file=sys.stderr)
+    print("INFO: {} of {} budgets analyzed.".format(len(paths) - failed, len(paths)))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,73 @@
+import random
+import argparse
+import yaml
+
+# Categories and items the analytics require, as in budget_sheet_template.yml
+SKELETON = {
+    "income": {"earned_income": ["name1_salary", "name1_bonus", "name2_salary"],
+               "passive_income": ["bank_interest", "dividends"]},
+    "expenses": {"personal_expenses": ["groceries", "dining"],
+                 "home_expenses": ["mortgage", "real_estate_tax", "homeowners_insurance"],
+                 "vehicle_expenses": ["car_loan", "fuel"],
+                 "insurance_premiums": ["medical_premium"],
+                 "subscriptions": ["netflix"]},
+    "retirement": ["name1_401k"],
+    "savings": ["emergency_fund"],
+}
+# Where generated items go, weighted like a real ledger
+SPREAD = [(("expenses", "personal_expenses"), 0.45), (("expenses", "home_expenses"), 0.15),
+          (("expenses", "vehicle_expenses"), 0.1), (("expenses", "insurance_premiums"), 0.05),
+          (("expenses", "subscriptions"), 0.1), (("income", "passive_income"), 0.05),
+          (("retirement",), 0.05), (("savings",), 0.05)]
+
+def generate_budget(items=100, depth=2, seed=0):
+    """Synthetic budget shaped like budget_sheet_template.yml with about the given number of line items
+
+    Items beyond the required ones are spread over the categories, and with depth > 2 they are
+    nested depth - 2 levels of groups below their category.
+    """
+    rng = random.Random(seed)
+    budget = {}
+    for category, children in SKELETON.items():
+        if isinstance(children, dict):
+            budget[category] = {sub: {item: round(rng.uniform(50, 500), 2) for item in leaves}
+                                for sub, leaves in children.items()}
+        else:
+            budget[category] = {item: round(rng.uniform(50, 500), 2) for item in children}
+    budget["income"]["earned_income"]["name1_salary"] = round(rng.uniform(4000, 9000), 2) * max(1, items // 50)
+
+    extra = max(0, items - sum(len(leaves) for leaves in _leaves(SKELETON)))
+    paths, weights = zip(*SPREAD)
+    for i in range(extra):
+        node = budget
+        for key in rng.choices(paths, weights)[0]:
+            node = node[key]
+        # Nest below the category in groups of about ten, to the requested depth. Groups are named
+        # after their parent, so like a real ledger's no label appears under two parents.
+        for level in range(depth - 2):
+            key = "{}_{}".format(key, rng.randrange(max(1, extra // 10 ** (level + 1))))
+            node = node.setdefault(key, {})
+        node["item_{}".format(i)] = round(rng.lognormvariate(3, 1), 2)
+    return {"monthly_budget": budget}
+
+def _leaves(tree):
+    for children in tree.values():
+        if isinstance(children, dict):
+            yield from _leaves(children)
+        else:
+            yield children
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--items', type=int, default=1000,
+                        help="Approximate number of line items")
+    parser.add_argument('-d', '--depth', type=int, default=2,
+                        help="Nesting depth of line items below monthly_budget")
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help="Random seed")
+    parser.add_argument('-o', '--output', type=str, default="synthetic_budget.yml",
+                        help="Output YAML file")
+    args = parser.parse_args()
+
+    with open(args.output, 'w') as yml:
+        yaml.safe_dump(generate_budget(args.items, args.depth, args.seed), yml, sort_keys=False)
@@ -0,0 +1,179 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import budget_analyzer
+import budget_loader
+from sankey_graph import SankeyGraph
+from generate_budget import generate_budget
+
+ANALYZE_STAGES = ["analyze_categories", "analyze_taxes", "analyze_budget"]
+# Modules the analytics-only path must never import at startup
+RENDER_MODULES = ["plotly", "mako", "markdown", "pdfkit", "kaleido"]
+
+def timed(func, repeats):
+    """Wall times of repeated calls, and the result of the last call"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return times, result
+
+def record(results, items, depth, stage, times, error=None):
+    entry = {"items": items, "depth": depth, "stage": stage}
+    if error:
+        entry["error"] = error
+    else:
+        entry.update(min=min(times), median=statistics.median(times), repeats=len(times))
+    results.append(entry)
+    print("{:>8} items  depth {}  {:<20} {}".format(items, depth, stage,
+          error or "{:.6f}s".format(min(times))), file=sys.stderr)
+
+def stage(results, items, depth, name, func, repeats):
+    """Time one stage, recording an error instead of a time if it fails"""
+    try:
+        times, result = timed(func, repeats)
+    except Exception as e:
+        record(results, items, depth, name, None, "{}: {}".format(type(e).__name__, " ".join(str(e).split())[:200]))
+        return None
+    record(results, items, depth, name, times)
+    return result
+
+def analyze_chain(budget, yml_name):
+    """Re-run the analysis chain from a clean state, timing each analyze_* method"""
+    budget.graph = SankeyGraph()
+    budget.data["analytics"] = {"name": budget.name, "yml_name": yml_name}
+    times = {}
+    for method in ANALYZE_STAGES:
+        start = time.perf_counter()
+        getattr(budget, method)()
+        times[method] = time.perf_counter() - start
+    return times
+
+def bench_budget(results, items, depth, repeats, export, workdir):
+    data = generate_budget(items, depth)
+    text = yaml.safe_dump(data, sort_keys=False)
+    stage(results, items, depth, "yaml_load", lambda: yaml.load(text, Loader=budget_loader.SafeLoader), repeats)
+    budget_file = os.path.join(workdir, "budget_{}_{}.yml".format(items, depth))
+    with open(budget_file, 'w') as yml:
+        yml.write(text)
+    cache_dir = os.path.join(workdir, "budget_cache")
+    budget_loader.load_budget(budget_file, cache_dir=cache_dir)
+    stage(results, items, depth, "cached_load", lambda: budget_loader.load_budget(budget_file, cache_dir=cache_dir), repeats)
+    budget = stage(results, items, depth, "init", lambda: budget_analyzer.MonthlyBudget(
+        "Benchmark", "synthetic", workdir, data, use_cache=False), repeats)
+    if budget is None:
+        return
+    stage(results, items, depth, "prettyfy", lambda: budget.prettyfy(data), repeats)
+    stage(results, items, depth, "recursive_items", lambda: list(budget.recursive_items(budget.data)), repeats)
+
+    chains = [analyze_chain(budget, "synthetic") for _ in range(repeats)]
+    for method in ANALYZE_STAGES:
+        record(results, items, depth, method, [chain[method] for chain in chains])
+
+    links = budget.graph.links()
+    labels = budget.graph.node_labels
+    def graph_build():
+        graph = SankeyGraph()
+        for s, t, v, c in zip(links["source"], links["target"], links["value"], links["color"]):
+            graph.add_link(labels[s], labels[t], v, c)
+        return graph
+    stage(results, items, depth, "graph_build", graph_build, repeats)
+    stage(results, items, depth, "graph_layout", budget.graph.layout, repeats)
+    stage(results, items, depth, "template_render", lambda: budget_analyzer.load_template().render(
+        trends=budget.trends, **budget.data["analytics"]), repeats)
+    if not export:
+        return
+    fig = stage(results, items, depth, "figure_build", budget.build_figure, repeats)
+    if fig is not None:
+        stage(results, items, depth, "html_export", lambda: fig.write_html(os.path.join(workdir, "viz.html")), 1)
+        stage(results, items, depth, "pdf_export", lambda: fig.write_image(
+            format="pdf", file=os.path.join(workdir, "viz.pdf"), width=1450, height=850), 1)
+
+def bench_startup(results, repeats, workdir):
+    """Cold-start time of the analytics-only CLI, and a check that it imports no rendering modules"""
+    budget_file = os.path.join(workdir, "startup_budget.yml")
+    with open(budget_file, 'w') as yml:
+        yaml.safe_dump(generate_budget(100), yml)
+    command = [sys.executable, os.path.join(ROOT, "budget_analyzer.py"), "-a", "--no-cache", "-i", budget_file]
+    # Keep the budget cache out of the user's home even if --no-cache is dropped
+    env = dict(os.environ, BUDGET_CACHE_DIR=os.path.join(workdir, "budget_cache"))
+    stage(results, 100, 2, "startup", lambda: subprocess.run(command, check=True, stdout=subprocess.DEVNULL, env=env),
+          repeats)
+
+    probe = "import sys, json; sys.path.insert(0, {!r}); import budget_analyzer; " \
+            "print(json.dumps([m for m in {!r} if m in sys.modules]))".format(ROOT, RENDER_MODULES)
+    eager = json.loads(subprocess.run([sys.executable, "-c", probe], check=True,
+                                      capture_output=True, text=True).stdout)
+    if eager:
+        record(results, 100, 2, "eager_imports", None, "rendering modules imported at startup: " + ", ".join(eager))
+    else:
+        record(results, 100, 2, "eager_imports", [0.0])
+
+def compare(results, baseline, tolerance):
+    """Stages slower than the baseline by more than the tolerance, or newly failing"""
+    previous = {(r["items"], r["depth"], r["stage"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        old = previous.get((r["items"], r["depth"], r["stage"]))
+        if old is None or "error" in old:
+            continue
+        if "error" in r:
+            regressions.append(dict(r, baseline=old["min"]))
+        elif r["min"] > old["min"] * (1 + tolerance):
+            regressions.append(dict(r, baseline=old["min"], ratio=r["min"] / old["min"]))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000],
+                        help="Approximate numbers of line items to benchmark")
+    parser.add_argument('-d', '--depths', type=int, nargs='+', default=[2],
+                        help="Nesting depths of line items to benchmark")
+    parser.add_argument('-r', '--repeats', type=int, default=5,
+                        help="Repeats per stage, the minimum is reported")
+    parser.add_argument('--no-export', action='store_true',
+                        help="Skip figure building and export")
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help="Write JSON results to this file instead of stdout")
+    parser.add_argument('-b', '--baseline', type=str, default=None,
+                        help="Earlier JSON results to compare against, exiting non-zero on regressions")
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25,
+                        help="Allowed slowdown against the baseline, as a fraction")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        bench_startup(results, args.repeats, workdir)
+        for depth in args.depths:
+            for items in args.sizes:
+                bench_budget(results, items, depth, args.repeats, not args.no_export, workdir + "/")
+    report = {"python": platform.python_version(), "platform": platform.platform(),
+              "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+    failed = any(r["stage"] == "eager_imports" and "error" in r for r in results)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for r in regressions:
+            print("REGRESSION: {items} items depth {depth} {stage}: ".format(**r) +
+                  (r["error"] if "error" in r else "{min:.6f}s vs {baseline:.6f}s".format(**r)), file=sys.stderr)
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
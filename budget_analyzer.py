@@ -2,54 +2,192 @@ import os
 import platform
 import subprocess
 import sys 
-import yaml
 import argparse
-import markdown
-import pdfkit
-import plotly.graph_objects as go
-from mako.template import Template
+import json
+import contextlib
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sankey_graph import SankeyGraph
+from budget_rollup import CategoryRollup
+from budget_loader import load_budget, prettyfy
+from tax_engine import load_tax_table, compute_taxes
+from render_cache import RenderCache, BlobStore, content_key
+from budget_history import HistoryStore, parse_month
+from instrumentation import StageTimer
+import sankey_graph
+
+TEMPLATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'budget_analysis.md')
+_templates = {}
+# Seconds the long-lived Kaleido browser gets to prove it can export before it is abandoned
+RENDERER_WARMUP_TIMEOUT = 30
+_renderer_tried = False
+_renderer_lock = threading.Lock()
+# Rendered artifacts of every budget, kept by content key at the output root
+RENDER_CACHE_DIR = ".render_cache"
+# Line items listed per top-level category in the report, all of them where not set
+TOP_ITEMS = {"Expenses": 5}
+# Top-level categories with their own rows in the report, any others are reported as other outflows
+STANDARD_CATEGORIES = ["Income", "Expenses", "Retirement", "Savings"]
+# Leaves kept per Sankey parent, and the smallest share of the parent a kept leaf may have
+SANKEY_TOP_N = 15
+SANKEY_MIN_SHARE = 0.01
+# How Sankey HTML files get plotly.js: embedded, from one shared file per output root, or from the CDN
+PLOTLYJS_MODES = ("inline", "shared", "cdn")
+
+def load_template(filename=TEMPLATE_FILE):
+    """Load and compile a Mako report template once per process"""
+    if filename not in _templates:
+        from mako.template import Template
+        _templates[filename] = Template(filename=filename)
+    return _templates[filename]
+
+def start_renderer(timeout=RENDERER_WARMUP_TIMEOUT):
+    """Start a long-lived Kaleido browser that every later figure export in this process reuses
+
+    Only the first call does anything, so it is made right before the first PDF export and
+    runs that cost nothing when every PDF is already up to date.
+    """
+    global _renderer_tried
+    with _renderer_lock:
+        if _renderer_tried:
+            return
+        _renderer_tried = True
+        try:
+            import kaleido
+        except ImportError:
+            return
+        # Kaleido < 1.0 already keeps its subprocess alive for the life of the process
+        if not hasattr(kaleido, 'start_sync_server'):
+            return
+
+        # A server whose browser cannot launch would leave every export waiting on it, so prove
+        # Chrome works with a tiny one-shot export first, which raises instead of hanging
+        result = []
+        def warm_up():
+            try:
+                result.append(kaleido.calc_fig_sync({"data": [], "layout": {}},
+                                                    opts=dict(format="png", width=10, height=10)))
+            except Exception as e:
+                result.append(e)
+        thread = threading.Thread(target=warm_up, daemon=True)
+        thread.start()
+        thread.join(timeout)
+        if not result or isinstance(result[0], Exception):
+            print("INFO: Kaleido could not export a figure ({}), exporting figures one at a time.".format(
+                  "no response" if not result else type(result[0]).__name__), file=sys.stderr)
+            return
+        kaleido.start_sync_server(silence_warnings=True)
+
+def stop_renderer():
+    """Shut down the long-lived Kaleido browser"""
+    try:
+        import kaleido
+    except ImportError:
+        return
+    if hasattr(kaleido, 'stop_sync_server'):
+        kaleido.stop_sync_server(silence_warnings=True)
+
+def budget_name(path):
+    """Derive a budget name from its file name, e.g. smith_household.yml -> Smith Household"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem.replace("_", " ").replace("-", " ").title()
+
+def write_plotlyjs(directory):
+    """Write the plotly.js bundle to a directory unless it is already there, returning its file name"""
+    from plotly.offline import get_plotlyjs, get_plotlyjs_version
+    file_name = "plotly-{}.min.js".format(get_plotlyjs_version())
+    path = os.path.join(directory, file_name)
+    if not os.path.exists(path):
+        # Batch workers may race to write it, so each writes its own copy and renames it into place
+        tmp_file = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_file, "w") as f:
+            f.write(get_plotlyjs())
+        os.replace(tmp_file, path)
+    return file_name
+
+@functools.lru_cache(maxsize=None)
+def compact_color(color):
+    """Shortest form of an rgb()/rgba() color, e.g. rgba(255,0,0,0.3) -> #ff00004d"""
+    if not color.startswith("rgb"):
+        return color
+    parts = [float(p) for p in color[color.index("(") + 1:color.rindex(")")].split(",")]
+    hex_color = "#" + "".join("{:02x}".format(int(round(p))) for p in parts[:3])
+    if len(parts) == 4 and parts[3] < 1:
+        hex_color += "{:02x}".format(int(round(parts[3] * 255)))
+    return hex_color
+
+def sankey_figure(graph, title):
+    """Plotly Sankey figure of a SankeyGraph, with its data rounded and colors compacted to keep the JSON small"""
+    import plotly.graph_objects as go
+    node_x, node_y = graph.layout()
+    node_x = [round(x, 4) for x in node_x]
+    node_y = [round(y, 4) for y in node_y]
+    node = dict(
+          pad = 10,
+          thickness = 10,
+          line = dict(color = "black", width = 0.15),
+          label = graph.node_labels,
+          color = "rgba(28,67,68,1)",
+          x = node_x,
+          y = node_y
+          )
+    link = graph.links()
+    link["value"] = [round(v, 2) for v in link["value"]]
+    colors = [compact_color(c) for c in graph.colors]
+    link["color"] = colors[0] if len(colors) == 1 else [colors[i] for i in graph.link_color]
+    data = go.Sankey(link = link,
+                     node = node,
+                     arrangement = 'freeform',
+                     valueformat = '$,')
+    fig = go.Figure(data)
+    fig.update_layout(title_text=title,
+                      font=dict(size=10, color='white'),
+                      hovermode='x', plot_bgcolor='black',
+                      paper_bgcolor='black')
+    return fig
 
 class MonthlyBudget():
     """Analyzing and visualizing montly budgets"""
-    def __init__(self, name, yml_name, output, data):
+    def __init__(self, name, yml_name, output, data, tax_year=2023,
+                 filing_status="married_filing_jointly", state="colorado", use_cache=True, timer=None,
+                 sankey_top_n=SANKEY_TOP_N, sankey_min_share=SANKEY_MIN_SHARE, plotlyjs="inline"):
         self.name = name
+        self.plotlyjs = plotlyjs
+        self.plotlyjs_file = None
+        # Both None draws every line item in the Sankey diagram
+        self.sankey_limits = (sankey_top_n, sankey_min_share)
+        # Stages are always timed, but only reported in the analytics when a timer is passed in
+        self.timer = timer if timer is not None else StageTimer(name)
+        self.tax_table = load_tax_table(tax_year, filing_status, state)
         if output:
             self.output = output if output[-1] == "/" else output + "/"
             self.dir = os.path.join(os.path.dirname(self.output), self.name.replace(" ", "_").lower() + "_budget")
         else:
             self.dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), self.name.replace(" ", "_").lower() + "_budget")
-        try:
-            os.makedirs(self.dir)
-        except FileExistsError:
-            print("INFO: Directory Exists.")
-            pass
-        self.data = self.prettyfy(data)['Monthly Budget']
+        self.use_cache = use_cache
+        self.cache = None
+        self.output_ready = False
+        if 'Monthly Budget' in data:
+            # Already prettified by load_budget, copied so the analytics stay out of the caller's tree
+            self.data = dict(data['Monthly Budget'])
+        else:
+            with self.timer.stage("prettyfy"):
+                self.data = self.prettyfy(data)['Monthly Budget']
         self.data['analytics'] = {}
         self.data['analytics']['name'] = self.name
         self.data['analytics']['yml_name'] = yml_name
-        self.node_step_x = 1/5
-        self.node_labels = []
-        self.node_x = []
-        self.link_source = []
-        self.link_target = []
-        self.link_value = []
-        self.link_color = []
-        self.build_node_labels()
-        self.analyze_income()
-        self.analyze_expenses()
-        self.analyze_taxes()
-        self.analyze_retirement()
-        self.analyze_savings()
-        self.analyze_budget()
+        if timer is not None:
+            self.data['analytics']['timings'] = self.timer.records
+        self.graph = SankeyGraph()
+        self.trends = None
+        for analyze in (self.analyze_categories, self.analyze_taxes, self.analyze_budget):
+            with self.timer.stage(analyze.__name__):
+                analyze()
 
     def prettyfy(self, dict1):
-        dict2 = {}
-        for k in dict1.keys():
-            if isinstance(dict1[k], dict):
-                dict2[k.replace("_", " ").title()] = self.prettyfy(dict1[k])
-            else:
-                dict2[k.replace("_", " ").title()] = dict1[k]
-        return dict2
+        return prettyfy(dict1)
 
     def recursive_items(self, dictionary):
         """Helper function to enumerate all keys in a nested dictionary"""
@@ -60,72 +198,126 @@ class MonthlyBudget():
             else:
                 yield (key, value)
 
-    def build_node_labels(self):
-        """Enumerate all nodes in the Sankey diagram based on imported data"""
-        for key,value in self.recursive_items(self.data):
-            self.node_labels.append(key)
-            if key in ('Jordan Salary', 'Taylor Salary', 'Wysocke Design',
-                       'Bank Interest', 'Credit Card Rewards', 'Dividends'):
-                self.node_x.append(0*self.node_step_x)
-            elif key in ('Earned Income', 'Passive Income'):
-                self.node_x.append(1*self.node_step_x)
-            elif key in ('Income'):
-                self.node_x.append(2*self.node_step_x)
-            elif key in ( 'Taxes', 'Expenses', 'Retirement', 'Savings'):
-                self.node_x.append(3*self.node_step_x)
-            elif key in ('Personal Expenses', 'Home Expenses',
-                         'Vehicle Expenses', 'Insurance Premiums',
-                         'Subscriptions'):
-                self.node_x.append(4*self.node_step_x)
-            else:
-                self.node_x.append(5*self.node_step_x)
-        self.node_y = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-                       0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0.52,
-                       0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-                       0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-                       0, 0]
+    def make_output_dir(self):
+        """Create the output directory and open its render cache on first use"""
+        if self.output_ready:
+            return
+        try:
+            os.makedirs(self.dir)
+        except FileExistsError:
+            print("INFO: Directory Exists.")
+            pass
+        if self.use_cache:
+            self.cache = RenderCache(self.dir, BlobStore(os.path.join(os.path.dirname(self.dir), RENDER_CACHE_DIR)))
+        if self.plotlyjs == "shared":
+            self.plotlyjs_file = write_plotlyjs(os.path.dirname(self.dir))
+        self.output_ready = True
+
+    def budget_key(self):
+        """Hash of the computed analytics and Sankey links, and of the code that draws the figure
+
+        Hashing what the analysis produced, rather than its inputs, covers changes to the tax
+        tables and to every module of the analysis alike.
+        """
+        analytics = {k: v for k, v in self.data["analytics"].items() if k != "timings"}
+        return content_key(self.name, analytics, self.graph.links(),
+                           files=[os.path.abspath(__file__), sankey_graph.__file__])
+
+    def cached(self, path, key):
+        """Whether an artifact is up to date, restoring an earlier rendering from the cache if possible"""
+        return self.cache is not None and (self.cache.fresh(path, key) or self.cache.restore(path, key))
+
+    def cache_artifact(self, path, key, keep=True):
+        """Store a freshly rendered artifact in the cache"""
+        if self.cache is not None:
+            self.cache.store(path, key, keep)
+            self.cache.save()
+
+    def add_trends(self, history, month=None):
+        """Pull trend figures for the report from a budget history store"""
+        self.trends = history.trends(month)
 
     def add_link_data(self, source, target, value, color):
         """Helper function to build the source, target, and value arrays"""
-        if source not in self.node_labels:
-            self.node_labels.append(source)
-        if target not in self.node_labels:
-            self.node_labels.append(target)
-        self.link_source.append(self.node_labels.index(source))
-        self.link_target.append(self.node_labels.index(target))
-        self.link_value.append(value)
-        self.link_color.append(color)
-
-    def build_viz(self, output):
-        """Generate the Sankey diagram"""
-        node = dict(
-              pad = 10,
-              thickness = 10,
-              line = dict(color = "black", width = 0.15),
-              label = self.node_labels,
-              color = "rgba(28,67,68,1)",
-#              x = self.node_x,
-#              y = self.node_y
-              )
-        link = dict(source = self.link_source,
-                    target = self.link_target,
-                    value = self.link_value,
-                    color = self.link_color)
-        data = go.Sankey(link = link,
-                         node = node,
-                         arrangement = 'freeform',
-                         valueformat = '$,')
-        fig = go.Figure(data)
-        fig_title = self.name.capitalize() + " Monthly Budget"
-        fig.update_layout(title_text=fig_title,
-                          font=dict(size=10, color='white'),
-                          hovermode='x', plot_bgcolor='black',
-                          paper_bgcolor='black')
-        fig.show()
+        self.graph.add_link(source, target, value, color)
+
+    def viz_artifacts(self):
+        """Sankey diagram files and the cache keys they are rendered from"""
         file_base_name = self.name.replace(" ", "_").lower()
         viz_file_name = self.dir + "/" + file_base_name
-        fig.write_image(format="pdf", file=viz_file_name + "_budget_viz.pdf", width=1450, height=850)
-        fig.write_html(viz_file_name + "_budget_viz.html")
+        budget_key = self.budget_key()
+        return [(viz_file_name + "_budget_viz.pdf", content_key(budget_key, self.sankey_limits, "pdf")),
+                (viz_file_name + "_budget_viz.html", content_key(budget_key, self.sankey_limits, "html", self.plotlyjs))]
+
+    def build_figure(self):
+        """Generate the Sankey diagram figure"""
+        return sankey_figure(self.sankey_graph(), self.name.capitalize() + " Monthly Budget")
+
+    def sankey_graph(self):
+        """The Sankey graph to draw, with small line items folded into "Other" nodes unless unlimited"""
+        if self.sankey_limits == (None, None):
+            return self.graph
+        return self.graph.reduce(*self.sankey_limits)
+
+    def plotlyjs_source(self):
+        """include_plotlyjs argument of write_html for the plotly.js mode"""
+        if self.plotlyjs == "shared":
+            # Relative to the budget directory, so the output root can be moved or uploaded as a whole
+            return "../" + self.plotlyjs_file
+        return "cdn" if self.plotlyjs == "cdn" else True
+
+    def write_figure(self, fig, path, key):
+        """Export the figure as a PDF or HTML artifact"""
+        if path.endswith(".pdf"):
+            start_renderer()
+            with self.timer.stage("pdf_export"):
+                fig.write_image(format="pdf", file=path, width=1450, height=850)
+        else:
+            with self.timer.stage("html_export"):
+                fig.write_html(path, include_plotlyjs=self.plotlyjs_source())
+        self.cache_artifact(path, key)
+
+    def stale_figure(self, show=False):
+        """Sankey artifacts that need rendering, and the figure to render them from if any"""
+        self.make_output_dir()
+        stale = [(path, key) for path, key in self.viz_artifacts() if not self.cached(path, key)]
+        if not stale and not show:
+            return [], None
+        with self.timer.stage("build_figure"):
+            fig = self.build_figure()
+        if show:
+            fig.show()
+        return stale, fig
+
+    def build_viz(self, output, show=True):
+        """Generate the Sankey diagram"""
+        stale, fig = self.stale_figure(show)
+        for path, key in stale:
+            self.write_figure(fig, path, key)
+
+    def render(self, output, show=False, open_report=False):
+        """Produce the PDF, HTML and Markdown artifacts concurrently"""
+        if self.timer.profile:
+            # cProfile cannot profile several threads at once, so profiled runs render inline
+            self.create_report(output, open_report)
+            self.build_viz(output, show)
+            return
+        self.make_output_dir()
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            jobs = [pool.submit(self.create_report, output, open_report)]
+            stale, fig = self.stale_figure(show)
+            jobs += [pool.submit(self.write_figure, fig, path, key) for path, key in stale]
+            for job in jobs:
+                job.result()
+
+    def line_item(self, *path):
+        """Amount of a line item, or zero if the budget does not have it"""
+        node = self.data
+        for key in path:
+            if not isinstance(node, dict) or key not in node:
+                return 0.0
+            node = node[key]
+        return node or 0.0
 
     def analyze_budget(self):
         """Calculate budget-level metrics"""
@@ -133,18 +325,17 @@ class MonthlyBudget():
         # Calculuate monthly net income
         self.data["analytics"]["net_income"] = round(self.data["analytics"]["income"] - self.data["analytics"]["taxes"], 2)
 
-        # Calculuate monthly net loss/gain
+        # Calculuate monthly net loss/gain, including any user-defined outflow categories
+        other_outflows = sum(self.data["analytics"]["other_outflows"].values())
         self.data["analytics"]["net_gain_loss"] = round(self.data["analytics"]["income"] - self.data["analytics"]["expenses"] - self.data["analytics"]["taxes"] - \
-                          self.data["analytics"]["retirement"] - self.data["analytics"]["savings"], 2)
+                          self.data["analytics"]["retirement"] - self.data["analytics"]["savings"] - other_outflows, 2)
         if self.data["analytics"]["net_gain_loss"] >= 0:
             self.add_link_data("Income", "Net Gain", self.data["analytics"]["net_gain_loss"], "rgba(0,255,0,0.3)")
         else:
             self.add_link_data("Net Loss", "Income", abs(self.data["analytics"]["net_gain_loss"]), "rgba(255,0,0,0.3)")
-        self.node_x.append(3*self.node_step_x)
-        self.node_y.append(0.99)
 
         # Calculuate discretionary income
-        dis_inc = self.data["analytics"]["income"] - self.data["analytics"]["taxes"] - self.data["analytics"]["expenses"] - self.data["analytics"]["retirement"]
+        dis_inc = self.data["analytics"]["income"] - self.data["analytics"]["taxes"] - self.data["analytics"]["expenses"] - self.data["analytics"]["retirement"] - other_outflows
         if dis_inc > 0:
             self.data["analytics"]["discretionary_income"] = dis_inc
         else:
@@ -164,15 +355,15 @@ class MonthlyBudget():
         self.data["analytics"]["annual_net_income_prct"] = self.data["analytics"]["annual_net_income"]/self.data["analytics"]["annual_income"]
 
         # Calculate mortgage-to-income ratio
-        self.data["analytics"]["total_mortgage"] = self.data["Expenses"]["Home Expenses"]["Mortgage"] +\
-                                               self.data["Expenses"]["Home Expenses"]["Real Estate Tax"] +\
-                                               self.data["Expenses"]["Home Expenses"]["Homeowners Insurance"]
+        self.data["analytics"]["total_mortgage"] = self.line_item("Expenses", "Home Expenses", "Mortgage") +\
+                                               self.line_item("Expenses", "Home Expenses", "Real Estate Tax") +\
+                                               self.line_item("Expenses", "Home Expenses", "Homeowners Insurance")
         self.data["analytics"]["mortgage_income_ratio"] = (self.data["analytics"]["total_mortgage"] /\
                                                           self.data["analytics"]["income"]) * 100
 
         # Calculuate debt-to-income ratio
         self.data["analytics"]["total_debt"] = self.data["analytics"]["total_mortgage"] +\
-                                               self.data["Expenses"]["Vehicle Expenses"]["Car Loan"]
+                                               self.line_item("Expenses", "Vehicle Expenses", "Car Loan")
 
         self.data["analytics"]["debt_income_ratio"] = (self.data["analytics"]["total_debt"] /\
                                                       self.data["analytics"]["income"]) * 100
@@ -181,128 +372,69 @@ class MonthlyBudget():
         # Calculuate suggested emergency fund
         self.data["analytics"]["emergency_fund"] = self.data["analytics"]["expenses"] * 6
 
+        # Retirement savings rate
+        self.data["analytics"]["retire_savings_rate"] = self.data["analytics"]["retirement"] / self.data["analytics"]["income"]
+
         # Calculuate savings rate
         self.data["analytics"]["savings_rate"] = (self.data["analytics"]["savings"] + self.data["analytics"]["retirement"]) / self.data["analytics"]["income"]
 
         # Calculuate FI number
         self.data["analytics"]["fi_number"] = self.data["analytics"]["expenses"] * 12 * 25
 
-    def analyze_income(self):
-        """Add income source, target, and value arrays"""
-        self.data["analytics"]["earned_income"] = 0.00
-        self.data["analytics"]["passive_income"] = 0.00
-        for budget_cat,budget_values in self.data.items():
-            if budget_cat == "Income":
-                for income_cat,income_values in budget_values.items():
-                    if income_cat == "Earned Income":
-                        for income_subcat,subcat_value in income_values.items():
-                            self.data["analytics"]["earned_income"] += subcat_value
-                            self.add_link_data(income_subcat, income_cat, subcat_value, "rgba(0,255,0,0.3)")
-                        self.add_link_data(income_cat, budget_cat, self.data["analytics"]["earned_income"], "rgba(0,255,0,0.3)")
-                    elif income_cat == "Passive Income":
-                        for income_subcat,subcat_value in income_values.items():
-                            self.data["analytics"]["passive_income"] += subcat_value
-                            self.add_link_data(income_subcat, income_cat, subcat_value, "rgba(0,255,0,0.3)")
-                        self.add_link_data(income_cat, budget_cat, self.data["analytics"]["passive_income"], "rgba(0,255,0,0.3)")
-        self.data["analytics"]["income"] = round(self.data["analytics"]["earned_income"] + self.data["analytics"]["passive_income"], 2)
+    def analyze_categories(self):
+        """Roll up every category in one pass, adding subtotals, top items and Sankey links"""
+        budget = {k: v for k, v in self.data.items() if k != 'analytics'}
+        self.rollup = CategoryRollup(self.graph, TOP_ITEMS).run(budget)
+        analytics = self.data["analytics"]
+        analytics["other_outflows"] = {}
+        for category in STANDARD_CATEGORIES + [c for c in self.rollup.categories if c not in STANDARD_CATEGORIES]:
+            key = category.replace(" ", "_").lower()
+            subtotals = dict(self.rollup.items(category))
+            analytics[key + "_categories"] = subtotals
+            if category in STANDARD_CATEGORIES:
+                analytics[key] = self.rollup.subtotal(category)
+            else:
+                analytics["other_outflows"][category] = self.rollup.subtotal(category)
+            # Keep the flat keys of the second-level income and expense categories, e.g. home_expenses
+            if category in ("Income", "Expenses"):
+                for subcategory in subtotals:
+                    if (category, subcategory) in self.rollup.children:
+                        analytics[subcategory.replace(" ", "_").lower()] = subtotals[subcategory]
+        analytics["top_expenses"] = self.rollup.top("Expenses")
+        analytics["top_retirement"] = self.rollup.top("Retirement")
+        analytics["top_savings"] = self.rollup.top("Savings")
 
     def analyze_taxes(self):
         """Add tax source, target, and value arrays"""
-        # Calculate taxable income
-        joint_standard_deduction = 27700/12
-        joint_tax_lvls = [22000,89450,190750,364200,462500,693750] 
-        joint_tax_rates = [.1,.12,.22,.24,.32,.35,.37] 
-        self.data["analytics"]["taxable_income"] = round(self.data["analytics"]["income"] - (joint_standard_deduction), 2)
-
-        # Calculate marginal tax bracket amounts
-        l1 = joint_tax_lvls[0] * joint_tax_rates[0]
-        l2 = ((joint_tax_lvls[1] - joint_tax_lvls[0]) * joint_tax_rates[1]) + l1
-        l3 = ((joint_tax_lvls[2] - joint_tax_lvls[1]) * joint_tax_rates[2]) + l2
-        l4 = ((joint_tax_lvls[3] - joint_tax_lvls[2]) * joint_tax_rates[3]) + l3
-        l5 = ((joint_tax_lvls[4] - joint_tax_lvls[3]) * joint_tax_rates[4]) + l4
-        l6 = ((joint_tax_lvls[5] - joint_tax_lvls[4]) * joint_tax_rates[5]) + l5
-        joint_tax_amts = [l1,l2,l3,l4,l5,l6]
-
-       # Compute federal income taxes based on  MFJ
-        if self.data["analytics"]["taxable_income"] <= joint_tax_lvls[0]/12:
-            self.data["analytics"]["high_tax_rate"] = joint_tax_rates[0]
-            self.fed_income_taxes = self.data["analytics"]["taxable_income"] * joint_tax_rates[0]
-        elif self.data["analytics"]["taxable_income"] <= joint_tax_lvls[1]/12: 
-            self.data["analytics"]["high_tax_rate"] = joint_tax_rates[1]
-            self.fed_income_taxes = (self.data["analytics"]["taxable_income"] - joint_tax_lvls[0]/12) * joint_tax_rates[1] + joint_tax_amts[0]/12
-        elif self.data["analytics"]["taxable_income"] <= joint_tax_lvls[2]/12: 
-            self.data["analytics"]["high_tax_rate"] = joint_tax_rates[2]
-            self.fed_income_taxes = (self.data["analytics"]["taxable_income"] - joint_tax_lvls[1]/12) * joint_tax_rates[2] + joint_tax_amts[1]/12
-        elif self.data["analytics"]["taxable_income"] <= joint_tax_lvls[3]/12: 
-            self.data["analytics"]["high_tax_rate"] = joint_tax_rates[3]
-            self.fed_income_taxes = (self.data["analytics"]["taxable_income"] - joint_tax_lvls[2]/12) * joint_tax_rates[3] + joint_tax_amts[2]/12
-        elif self.data["analytics"]["taxable_income"] <= joint_tax_lvls[4]/12: 
-            self.data["analytics"]["high_tax_rate"] = joint_tax_rates[4]
-            self.fed_income_taxes = (self.data["analytics"]["taxable_income"] - joint_tax_lvls[3]/12) * joint_tax_rates[4] + joint_tax_amts[3]/12
-        elif self.data["analytics"]["taxable_income"] <= joint_tax_lvls[5]/12: 
-            self.data["analytics"]["high_tax_rate"] = joint_tax_rates[5]
-            self.fed_income_taxes = (self.data["analytics"]["taxable_income"] - joint_tax_lvls[4]/12) * joint_tax_rates[5] + joint_tax_amts[4]/12
-        else:
-            self.data["analytics"]["high_tax_rate"] = joint_tax_rates[6]
-            self.fed_income_taxes = (self.data["analytics"]["taxable_income"] - joint_tax_lvls[5]/12) * joint_tax_rates[6] + joint_tax_amts[5]/12
-        # Dedeuct montly child tax credit
-        child_tax_credit = 2000/12
-        self.fed_income_taxes = self.fed_income_taxes - child_tax_credit
+        earned_income = dict(self.rollup.items("Income", "Earned Income"))
+        wages = list(earned_income.values())
+        # Assume income that is not a salary or bonus is business income, so you pay double FICA
+        self_employed = ["Salary" not in income and "Bonus" not in income for income in earned_income]
+        taxes = compute_taxes(self.tax_table, self.data["analytics"]["income"], wages, self_employed)
+
+        # Federal income taxes, less the monthly child tax credit
+        self.data["analytics"]["taxable_income"] = float(taxes["taxable_income"])
+        self.data["analytics"]["high_tax_rate"] = float(taxes["high_tax_rate"])
+        self.fed_income_taxes = float(taxes["federal"])
         self.data["analytics"]["fed_income_taxes"] = round(self.fed_income_taxes, 2)
         self.add_link_data("Taxes", "Federal Income", self.data["analytics"]["fed_income_taxes"], "rgba(255,0,0,0.3)")
 
-        # Compute Colorado state income tax, 4.40% for income, 0.45% for FAMLI in 2023
-        state_inc_tax_rate = 0.0440
-        famli_rate = 0.0045
-        max_oasdi_amt = 160200
-        
-        state_inc_tax = self.data["analytics"]["income"] * state_inc_tax_rate 
-
-        if self.data["analytics"]["income"]/12 < max_oasdi_amt/12:
-            famli_tax = (self.data["analytics"]["income"]/12) * famli_rate
-        else:
-            famli_tax = (max_oasdi_amt/12) * famli_rate
-
-        self.data["analytics"]["state_income_taxes"] = round(state_inc_tax + famli_tax, 2)
+        # State income tax and FAMLI
+        self.data["analytics"]["state_income_taxes"] = round(float(taxes["state"] + taxes["famli"]), 2)
         self.add_link_data("Taxes", "State Income", self.data["analytics"]["state_income_taxes"], "rgba(255,0,0,0.3)")
-        
-        # Compute FICA taxes
-        oasdi_tax_tot = 0
-        med_tax_tot = 0
-        for income,value in self.data["Income"]["Earned Income"].items():
-            income_name = income.replace(" ","_").lower() 
+
+        # FICA taxes per earned income source
+        for income,oasdi_tax,med_tax in zip(earned_income, taxes["oasdi"].tolist(), taxes["medicare"].tolist()):
+            income_name = income.replace(" ","_").lower()
             oasdi_name = income_name + "_oasdi_tax"
-            oasdi_rate = 0.062
             med_name = income_name + "_med_tax"
-            med_rate = 0.0145
-            # Compute OASDI taxes (use gross income, not taxable income)
-            if value < max_oasdi_amt/12:
-                oasdi_tax = round(value * oasdi_rate, 2)
-            else:
-                oasdi_tax = round((max_oasdi_amt/12) * oasdi_rate, 2)
-               
-            # Compute Medicare taxes (use gross income, not taxable income)
-            if self.data["analytics"]["income"] <= 250000/12: 
-                med_tax = round(value * med_rate, 2)
-            else: #additional medicare tax of 0.9%
-                extra_ratio = (self.data["analytics"]["income"] - (250000/12)) / self.data["analytics"]["income"]
-                med_tax = round(value * med_rate + (value * extra_ratio) * 0.009, 2)
-
-            if "Salary" not in income and "Bonus" not in income: #assume tax is for business income, so you pay double
-                oasdi_tax = oasdi_tax * 2
-                med_tax = med_tax * 2
-
-            oasdi_tax_tot += oasdi_tax
-            med_tax_tot += med_tax
-
             self.data["analytics"][oasdi_name] = round(oasdi_tax, 2)
             self.data["analytics"][med_name] = round(med_tax, 2)
- 
             self.add_link_data("Taxes", oasdi_name.replace("_", " ").title(), oasdi_tax, "rgba(255,0,0,0.3)")
             self.add_link_data("Taxes", med_name.replace("_", " ").title(), med_tax, "rgba(255,0,0,0.3)")
 
-        self.data["analytics"]["oasdi_tax"] = round(oasdi_tax_tot, 2)
-        self.data["analytics"]["med_tax"] = round(med_tax_tot, 2)
+        self.data["analytics"]["oasdi_tax"] = round(float(taxes["oasdi_total"]), 2)
+        self.data["analytics"]["med_tax"] = round(float(taxes["medicare_total"]), 2)
         self.data["analytics"]["fica_taxes"] = round(self.data["analytics"]["oasdi_tax"] + self.data["analytics"]["med_tax"], 2)
 
         self.data["analytics"]["taxes"] = self.data["analytics"]["fed_income_taxes"] + self.data["analytics"]["state_income_taxes"] + self.data["analytics"]["oasdi_tax"] + self.data["analytics"]["med_tax"]
@@ -314,107 +446,25 @@ class MonthlyBudget():
         self.data["analytics"]["effective_fica_tax_rate"] = round(self.data["analytics"]["fica_taxes"] / self.data["analytics"]["income"], 6)
         self.data["analytics"]["effective_tax_rate"] = round(self.data["analytics"]["taxes"] / self.data["analytics"]["income"], 6)
 
-    def analyze_retirement(self):
-        """Add retirement source, target, and value arrays"""
-        self.data["analytics"]["retirement"] = 0.00
-        for budget_cat,budget_value in self.data.items():
-            if budget_cat == "Retirement":
-                for retire,retire_value in budget_value.items():
-                    self.data["analytics"]["retirement"] += retire_value
-                    self.add_link_data(budget_cat, retire, retire_value, "rgba(28,67,68,0.3)")
-        self.data["analytics"]["retirement"] = round(self.data["analytics"]["retirement"], 2)
-        self.add_link_data("Income", "Retirement", self.data["analytics"]["retirement"], "rgba(28,67,68,0.3)")
-        # Retirement savings rate
-        self.data["analytics"]["retire_savings_rate"] = self.data["analytics"]["retirement"] / self.data["analytics"]["income"]
+    def report_markdown(self):
+        """Render the Markdown report from the analytics"""
+        with self.timer.stage("report_render"):
+            return load_template().render(trends=self.trends, **self.data["analytics"])
 
-        # Flatten nested dictionaries, then sort highest to lowest
-        flattened_retirement = {}
-        for key,value in self.recursive_items(self.data["Retirement"]):
-            if type(value) is not dict:
-                flattened_retirement[key] = value
-        top_retirement = dict(sorted(flattened_retirement.items(), key=lambda item: item[1], reverse=True))
-        self.data["analytics"]["top_retirement"] = top_retirement
-
-    def analyze_savings(self):
-        """Add savings source, target, and value arrays"""
-        self.data["analytics"]["savings"] = 0.00
-        for budget_cat,budget_value in self.data.items():
-            if budget_cat == "Savings":
-                for save,save_value in budget_value.items():
-                    self.data["analytics"]["savings"] += save_value
-                    self.add_link_data(budget_cat, save, save_value, "rgba(28,67,68,0.3)")
-        self.data["analytics"]["savings"] = round(self.data["analytics"]["savings"], 2)
-        self.add_link_data("Income", "Savings", self.data["analytics"]["savings"], "rgba(28,67,68,0.3)")
-
-        # Flatten nested dictionaries, then sort highest to lowest
-        flattened_savings = {}
-        for key,value in self.recursive_items(self.data["Savings"]):
-            if type(value) is not dict:
-                flattened_savings[key] = value
-        top_savings = dict(sorted(flattened_savings.items(), key=lambda item: item[1], reverse=True))
-        self.data["analytics"]["top_savings"] = top_savings
-
-    def analyze_expenses(self):
-        """Add expense source, target, and value arrays"""
-        self.data["analytics"]["personal_expenses"] = 0.00
-        self.data["analytics"]["home_expenses"] = 0.00
-        self.data["analytics"]["vehicle_expenses"] = 0.00
-        self.data["analytics"]["insurance_premiums"] = 0.00
-        self.data["analytics"]["subscriptions"] = 0.00
-        for budget_cat,budget_values in self.data.items():
-            if budget_cat == "Expenses":
-                for expense_cat,expense_values in budget_values.items():
-                    if expense_cat == "Personal Expenses":
-                        for expense_subcat,subcat_value in expense_values.items():
-                            self.data["analytics"]["personal_expenses"] += subcat_value
-                            self.add_link_data(expense_cat, expense_subcat, subcat_value, "rgba(255,0,0,0.3)")
-                        self.data["analytics"]["personal_expenses"] = round(self.data["analytics"]["personal_expenses"], 2)
-                        self.add_link_data(budget_cat, expense_cat, self.data["analytics"]["personal_expenses"], "rgba(255,0,0,0.3)")
-                    elif expense_cat == "Home Expenses":
-                        for expense_subcat,subcat_value in expense_values.items():
-                            self.data["analytics"]["home_expenses"] += subcat_value
-                            self.add_link_data(expense_cat, expense_subcat, subcat_value, "rgba(255,0,0,0.3)")
-                        self.data["analytics"]["home_expenses"] = round(self.data["analytics"]["home_expenses"], 2)
-                        self.add_link_data(budget_cat, expense_cat, self.data["analytics"]["home_expenses"], "rgba(255,0,0,0.3)")
-                    elif expense_cat == "Vehicle Expenses":
-                        for expense_subcat,subcat_value in expense_values.items():
-                            self.data["analytics"]["vehicle_expenses"] += subcat_value
-                            self.add_link_data(expense_cat, expense_subcat, subcat_value, "rgba(255,0,0,0.3)")
-                        self.data["analytics"]["vehicle_expenses"] = round(self.data["analytics"]["vehicle_expenses"], 2)
-                        self.add_link_data(budget_cat, expense_cat, self.data["analytics"]["vehicle_expenses"], "rgba(255,0,0,0.3)")
-                    elif expense_cat == "Insurance Premiums":
-                        for expense_subcat,subcat_value in expense_values.items():
-                            self.data["analytics"]["insurance_premiums"] += subcat_value
-                            self.add_link_data(expense_cat, expense_subcat, subcat_value, "rgba(255,0,0,0.3)")
-                        self.data["analytics"]["insurance_premiums"] = round(self.data["analytics"]["insurance_premiums"], 2)
-                        self.add_link_data(budget_cat, expense_cat, self.data["analytics"]["insurance_premiums"], "rgba(255,0,0,0.3)")
-                    elif expense_cat == "Subscriptions":
-                        for expense_subcat,subcat_value in expense_values.items():
-                            self.data["analytics"]["subscriptions"] += subcat_value
-                            self.add_link_data(expense_cat, expense_subcat, subcat_value, "rgba(255,0,0,0.3)")
-                        self.data["analytics"]["subscriptions"] = round(self.data["analytics"]["subscriptions"], 2)
-                        self.add_link_data(budget_cat, expense_cat, self.data["analytics"]["subscriptions"], "rgba(255,0,0,0.3)")
-        self.data["analytics"]["expenses"] = round(self.data["analytics"]["personal_expenses"] + self.data["analytics"]["home_expenses"] + \
-                        self.data["analytics"]["vehicle_expenses"] + self.data["analytics"]["insurance_premiums"] + 
-                        self.data["analytics"]["subscriptions"], 2)
-        self.add_link_data("Income", "Expenses", self.data["analytics"]["expenses"], "rgba(255,0,0,0.3)")
-
-        # Flatten nested dictionaries, then sort highest to lowest
-        flattened_expenses = {}
-        for key,value in self.recursive_items(self.data["Expenses"]):
-            if type(value) is not dict:
-                flattened_expenses[key] = value
-        top_expenses = dict(sorted(flattened_expenses.items(), key=lambda item: item[1], reverse=True)[:5])
-        self.data["analytics"]["top_expenses"] = top_expenses
-
-    def create_report(self, output):
-        report = Template(filename='templates/budget_analysis.md')
-        kwargs = self.data["analytics"]
-        report_md = report.render(**kwargs)
+    def create_report(self, output, open_report=True):
+        self.make_output_dir()
         file_base_name = self.name.replace(" ", "_").lower()
         report_file = self.dir + "/" + file_base_name + "_budget_report.md"
-        with open(report_file, "w+") as file:
-            file.write(os.path.join(self.dir, report_md))
+        report_key = content_key(self.budget_key(), self.data["analytics"]["yml_name"], self.trends,
+                                 self.data["analytics"].get("timings"), "report", files=[TEMPLATE_FILE])
+        if not self.cached(report_file, report_key):
+            report_md = self.report_markdown()
+            with open(report_file, "w+") as file:
+                file.write(os.path.join(self.dir, report_md))
+            # A report with run timings is never rendered from the same key twice, so keep no copy of it
+            self.cache_artifact(report_file, report_key, keep="timings" not in self.data["analytics"])
+        if not open_report:
+            return
         if platform.system() == 'Darwin':
             subprocess.call(('open', report_file))
         elif platform.system() == 'Windows':
@@ -422,21 +472,83 @@ class MonthlyBudget():
         else:
             subprocess.call(('xdg-open', report_file))
 
+#        import markdown
+#        import pdfkit
 #        html = markdown.markdown(report_md, extensions=['markdown.extensions.tables'])
 #        pdfkit.from_string(html, 'report.pdf')
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('-i', '--input', type=str, required=True,
-                        help="Input YAML file containing monthly budget data")
+    parser.add_argument('-i', '--input', type=str, nargs='+', required=True,
+                        help="Input YAML file(s) containing monthly budget data")
     parser.add_argument('-o', '--output', nargs='?', const=1, type=str, default="",
                         help="Output location for budget report markdown file")
     parser.add_argument('-n', '--name', nargs='?', const=1, type=str, default="Untitled Budget",
                         help="Name of the budget")
+    parser.add_argument('--tax-year', type=int, default=2023,
+                        help="Tax year of the bracket tables in tax_tables/")
+    parser.add_argument('--filing-status', type=str, default="married_filing_jointly",
+                        choices=["married_filing_jointly", "single", "head_of_household"],
+                        help="Federal filing status")
+    parser.add_argument('--state', type=str, default="colorado",
+                        help="State income tax table")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Re-parse every input and re-render every artifact even if unchanged")
+    parser.add_argument('-d', '--history', type=str, default=None,
+                        help="Budget history store directory to pull trend figures from")
+    parser.add_argument('-m', '--month', type=str, default=None,
+                        help="Month of the budget, e.g. 2023-01, to record it in the history store")
+    parser.add_argument('-a', '--analytics-only', action='store_true',
+                        help="Only compute the analytics and print them to stdout, without rendering")
+    parser.add_argument('-f', '--format', type=str, default="json", choices=["json", "ndjson"],
+                        help="Output format of --analytics-only, one document or one line per budget")
+    parser.add_argument('-t', '--timings', type=str, default=None,
+                        help="Record per-stage timings in the analytics and report, and append them as NDJSON to this file ('-' for stderr), with each stage's RSS change and the process's peak RSS; only --profile measures a stage's own peak memory")
+    parser.add_argument('-p', '--profile', type=str, default=None,
+                        help="Profile every stage with cProfile and tracemalloc, recording its peak traced memory and dumping .prof files to this directory")
+    parser.add_argument('--sankey-top-n', type=int, default=SANKEY_TOP_N,
+                        help="Line items kept per Sankey category, the rest are folded into an \"Other\" node")
+    parser.add_argument('--sankey-min-share', type=float, default=SANKEY_MIN_SHARE,
+                        help="Fold Sankey line items below this fraction of their category into an \"Other\" node")
+    parser.add_argument('--sankey-full', action='store_true',
+                        help="Draw every line item in the Sankey diagram")
+    parser.add_argument('--plotlyjs', type=str, default="inline", choices=PLOTLYJS_MODES,
+                        help="Embed plotly.js in the Sankey HTML, share one copy in the output root, or load it from the CDN")
     args = parser.parse_args()
-
-    yml = open(args.input, 'r')
-    data = yaml.full_load(yml)
-    budget = MonthlyBudget(args.name, args.input, args.output, data)
-    budget.build_viz(args.output)
-    budget.create_report(args.output)
+    if args.sankey_full:
+        args.sankey_top_n = args.sankey_min_share = None
+    if args.month:
+        try:
+            args.month = parse_month(args.month)
+        except ValueError as e:
+            parser.error(str(e))
+
+    timings_sink = None
+    if args.timings:
+        timings_sink = sys.stderr if args.timings == "-" else open(args.timings, 'a')
+    results = []
+    for input_file in args.input:
+        # Name multiple budgets after their files, since a single --name would collide
+        name = args.name if len(args.input) == 1 else budget_name(input_file)
+        timer = None
+        if args.timings or args.profile:
+            timer = StageTimer(name, timings_sink, args.profile is not None, args.profile)
+        with timer.stage("yaml_load") if timer else contextlib.nullcontext():
+            data = load_budget(input_file, not args.no_cache)
+        budget = MonthlyBudget(name, input_file, args.output, data,
+                               args.tax_year, args.filing_status, args.state, not args.no_cache, timer,
+                               args.sankey_top_n, args.sankey_min_share, args.plotlyjs)
+        if args.history:
+            history = HistoryStore(args.history)
+            if args.month:
+                history.append(args.month, data)
+            budget.add_trends(history, args.month)
+        if not args.analytics_only:
+            budget.render(args.output, show=True, open_report=True)
+        elif args.format == "ndjson":
+            print(json.dumps(budget.data["analytics"]), flush=True)
+        else:
+            results.append(budget.data["analytics"])
+    if args.analytics_only and args.format == "json":
+        json.dump(results[0] if len(results) == 1 else results, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,186 @@
+import os
+import json
+import bisect
+import argparse
+from datetime import datetime
+import yaml
+import numpy as np
+
+from budget_loader import flatten_leaves, normalize_key
+
+def parse_month(month):
+    """Canonical YYYY-MM form of a month like 2023-01 or 2023-1, raising ValueError for anything else"""
+    try:
+        parsed = datetime.strptime(month, "%Y-%m")
+    except (TypeError, ValueError):
+        raise ValueError("Invalid month '{}', expected YYYY-MM, e.g. 2023-01".format(month)) from None
+    return "{:04d}-{:02d}".format(parsed.year, parsed.month)
+
+def month_number(month):
+    """Months since year 0 of a YYYY-MM month, so months can be subtracted across years"""
+    year, month = month.split("-")
+    return int(year) * 12 + int(month) - 1
+
+class HistoryStore():
+    """Columnar store of monthly budgets, one int64 column of cents per leaf item and one row per month
+
+    The amounts live in a flat row-major file that is memory-mapped for reads, so trend figures
+    over years of history never parse YAML. Appending a later month appends one row; new items or
+    back-filled months rewrite the file.
+    """
+    def __init__(self, directory):
+        self.dir = directory
+        self.meta_file = os.path.join(directory, 'meta.json')
+        self.amounts_file = os.path.join(directory, 'amounts.i8')
+        try:
+            with open(self.meta_file, 'r') as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            meta = {"columns": [], "months": []}
+        self.columns = meta["columns"]
+        self.months = meta["months"]
+        self.column_index = {column: i for i, column in enumerate(self.columns)}
+
+    def amounts(self):
+        """Memory-mapped (months, columns) matrix of amounts in cents"""
+        if not self.months or not self.columns:
+            return np.zeros((len(self.months), len(self.columns)), dtype='<i8')
+        return np.memmap(self.amounts_file, dtype='<i8', mode='r', shape=(len(self.months), len(self.columns)))
+
+    def append(self, month, data):
+        """Add or replace the budget of one month, given as a raw or prettified budget dict"""
+        month = parse_month(month)
+        tree = {normalize_key(k): v for k, v in data.items()}.get("monthly_budget", data)
+        leaves = {".".join(path): value for path, value in flatten_leaves(tree)}
+        new_columns = [column for column in leaves if column not in self.column_index]
+        os.makedirs(self.dir, exist_ok=True)
+        if new_columns or (self.months and month_number(month) < month_number(self.months[-1]) and
+                           month not in self.months):
+            # Widen the matrix or insert a row in month order, rewriting the file
+            amounts = np.array(self.amounts())
+            amounts = np.hstack((amounts, np.zeros((len(self.months), len(new_columns)), dtype='<i8')))
+            for column in new_columns:
+                self.column_index[column] = len(self.columns)
+                self.columns.append(column)
+            if month not in self.months:
+                position = bisect.bisect_left([month_number(m) for m in self.months], month_number(month))
+                amounts = np.insert(amounts, position, 0, axis=0)
+                self.months.insert(position, month)
+            amounts[self.months.index(month)] = self.row(leaves)
+            tmp_file = self.amounts_file + ".tmp"
+            amounts.tofile(tmp_file)
+            os.replace(tmp_file, self.amounts_file)
+        elif month in self.months:
+            amounts = np.memmap(self.amounts_file, dtype='<i8', mode='r+', shape=(len(self.months), len(self.columns)))
+            amounts[self.months.index(month)] = self.row(leaves)
+            amounts.flush()
+        else:
+            with open(self.amounts_file, 'ab') as f:
+                self.row(leaves).tofile(f)
+            self.months.append(month)
+        self.save()
+
+    def row(self, leaves):
+        """Fixed-point cents for one month of leaf amounts"""
+        row = np.zeros(len(self.columns), dtype='<i8')
+        for column, value in leaves.items():
+            row[self.column_index[column]] = int(round(float(value) * 100))
+        return row
+
+    def save(self):
+        tmp_file = self.meta_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump({"columns": self.columns, "months": self.months}, f)
+        os.replace(tmp_file, self.meta_file)
+
+    def calendar(self, month, span):
+        """Amounts of the span calendar months through month, with zero rows for months without a budget
+
+        The span is cut short at the first stored month.
+        """
+        end = month_number(month)
+        start = max(end - span + 1, month_number(self.months[0]))
+        stored = self.amounts()
+        amounts = np.zeros((end - start + 1, len(self.columns)), dtype='<i8')
+        for row, stored_month in enumerate(self.months):
+            offset = month_number(stored_month) - start
+            if 0 <= offset < len(amounts):
+                amounts[offset] = stored[row]
+        return amounts
+
+    def category(self, prefix, amounts=None):
+        """Monthly totals in cents for every leaf under a dotted category path"""
+        amounts = self.amounts() if amounts is None else amounts
+        prefix = prefix + "."
+        cols = [i for i, column in enumerate(self.columns) if column.startswith(prefix)]
+        return amounts[:, cols].sum(axis=1)
+
+    # The trend figures below take one total per consecutive calendar month, as from calendar()
+
+    @staticmethod
+    def rolling_mean(totals, window=3):
+        """Mean of each month and up to window-1 months before it"""
+        cumulative = np.concatenate(([0], np.cumsum(totals)))
+        ends = np.arange(1, len(totals) + 1)
+        starts = np.maximum(ends - window, 0)
+        return (cumulative[ends] - cumulative[starts]) / (ends - starts)
+
+    @staticmethod
+    def trailing_total(totals, months=12):
+        """Sum of each month and up to months-1 months before it"""
+        cumulative = np.concatenate(([0], np.cumsum(totals)))
+        ends = np.arange(1, len(totals) + 1)
+        return cumulative[ends] - cumulative[np.maximum(ends - months, 0)]
+
+    @staticmethod
+    def month_over_month(totals):
+        """Change from the previous month, zero for the first month"""
+        return np.diff(totals, prepend=totals[:1])
+
+    def trends(self, month=None, window=3):
+        """Trend figures in dollars for every top-level and second-level category through a month"""
+        if not self.months:
+            return None
+        month = parse_month(month) if month else self.months[-1]
+        if month_number(month) < month_number(self.months[0]):
+            return None
+        categories = []
+        for column in self.columns:
+            parts = column.split(".")
+            for depth in (1, 2):
+                if len(parts) > depth and ".".join(parts[:depth]) not in categories:
+                    categories.append(".".join(parts[:depth]))
+        amounts = self.calendar(month, max(window, 12))
+        trends = {"month": month, "months": len(amounts), "categories": []}
+        for category in categories:
+            totals = self.category(category, amounts)
+            trends["categories"].append({
+                "name": category.split(".")[-1].replace("_", " ").title(),
+                "depth": category.count("."),
+                "amount": float(totals[-1]) / 100,
+                "change": float(self.month_over_month(totals)[-1]) / 100,
+                "rolling_mean": float(self.rolling_mean(totals, window)[-1]) / 100,
+                "trailing_12": float(self.trailing_total(totals)[-1]) / 100,
+            })
+        return trends
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--history', type=str, required=True,
+                        help="History store directory")
+    parser.add_argument('-i', '--input', type=str, nargs='+', required=True,
+                        help="Monthly budget YAML files named or prefixed by their month, e.g. 2023-01_budget.yml")
+    args = parser.parse_args()
+
+    # Check every month before storing any, so one misnamed file leaves the store untouched
+    months = []
+    for input_file in args.input:
+        try:
+            months.append(parse_month(os.path.basename(input_file)[:7]))
+        except ValueError as e:
+            parser.error("{}: {}".format(input_file, e))
+    store = HistoryStore(args.history)
+    for input_file, month in zip(args.input, months):
+        with open(input_file, 'r') as yml:
+            store.append(month, yaml.safe_load(yml))
+        print("INFO: Stored {} as {}".format(input_file, month))
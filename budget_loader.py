@@ -0,0 +1,105 @@
+import os
+import sys
+import json
+import hashlib
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+CACHE_DIR = os.environ.get("BUDGET_CACHE_DIR",
+                           os.path.join(os.path.expanduser("~"), ".cache", "budget_analyzer"))
+# Bump when prettyfy or the cache format changes, so trees cached by older code are not reused
+CACHE_VERSION = 2
+
+def prettyfy(dict1):
+    """Title-case every key of a nested budget, e.g. earned_income -> Earned Income"""
+    dict2 = {}
+    for k, v in dict1.items():
+        if isinstance(v, dict):
+            dict2[k.replace("_", " ").title()] = prettyfy(v)
+        else:
+            dict2[k.replace("_", " ").title()] = v
+    return dict2
+
+def normalize_key(key):
+    """Match raw YAML keys and prettified keys alike, e.g. Earned Income -> earned_income"""
+    return str(key).replace(" ", "_").lower()
+
+def flatten_leaves(dictionary, path=()):
+    """Enumerate (path, value) for every leaf item of a nested budget"""
+    for key, value in dictionary.items():
+        if isinstance(value, dict):
+            yield from flatten_leaves(value, path + (normalize_key(key),))
+        else:
+            yield (path + (normalize_key(key),), value or 0.0)
+
+def load_yaml(path):
+    """Parse a YAML file with LibYAML when it is available"""
+    with open(path, 'r') as yml:
+        return yaml.load(yml, Loader=SafeLoader)
+
+def cache_file(path, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:32] + ".json")
+
+def load_budget(path, use_cache=True, cache_dir=CACHE_DIR):
+    """Parsed and prettified budget tree of a YAML file
+
+    The tree is cached as JSON keyed on the file's path, mtime and size, so repeat loads of an
+    unchanged file skip both YAML parsing and prettyfy. Each cache file holds the key on its
+    first line and the tree on its second, and being plain data it cannot run code when read.
+    """
+    stat = os.stat(path)
+    key = [CACHE_VERSION, os.path.abspath(path), stat.st_mtime_ns, stat.st_size]
+    cached = cache_file(path, cache_dir)
+    if use_cache:
+        try:
+            with open(cached, 'r') as f:
+                if json.loads(f.readline()) == key:
+                    return json.loads(f.readline())
+        except (OSError, ValueError):
+            pass
+    tree = prettyfy(load_yaml(path))
+    if use_cache:
+        try:
+            # Values JSON cannot hold, like YAML dates, leave the budget uncached
+            entry = json.dumps(key) + "\n" + json.dumps(tree) + "\n"
+        except (TypeError, ValueError):
+            return tree
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_file = "{}.{}.tmp".format(cached, os.getpid())
+            with open(tmp_file, 'w') as f:
+                f.write(entry)
+            os.replace(tmp_file, cached)
+        except OSError:
+            print("INFO: Could not write the budget cache in {}.".format(cache_dir), file=sys.stderr)
+    return tree
+
+def prune_cache(cache_dir=CACHE_DIR):
+    """Remove cached trees whose budget file no longer exists, and caches of older versions"""
+    try:
+        names = os.listdir(cache_dir)
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    for name in names:
+        cached = os.path.join(cache_dir, name)
+        if name.endswith(".json"):
+            try:
+                with open(cached, 'r') as f:
+                    key = json.loads(f.readline())
+                if key[0] == CACHE_VERSION and os.path.exists(key[1]):
+                    continue
+            except (OSError, ValueError, TypeError, IndexError, KeyError):
+                pass
+        elif not name.endswith(".pickle"):
+            continue
+        try:
+            os.remove(cached)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
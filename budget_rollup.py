@@ -0,0 +1,81 @@
+import heapq
+import itertools
+
+INFLOW = "Income"
+COLORS = {"Income": "rgba(0,255,0,0.3)", "Expenses": "rgba(255,0,0,0.3)",
+          "Retirement": "rgba(28,67,68,0.3)", "Savings": "rgba(28,67,68,0.3)"}
+DEFAULT_COLOR = "rgba(255,0,0,0.3)"
+
+class CategoryRollup():
+    """Single post-order pass over a budget tree of any shape
+
+    Every category node gets its subtotal, every top-level category keeps a bounded heap of its
+    largest line items, and the Sankey links are added to graph as each node is finished. Income
+    children flow into Income, and every other top-level category, including user-defined ones,
+    flows out of Income.
+    """
+    def __init__(self, graph=None, top_n=None):
+        self.graph = graph
+        self.top_n = top_n or {}
+        self.subtotals = {}
+        self.children = {}
+        self.categories = []
+        self.heaps = {}
+        self.counter = itertools.count()
+
+    def run(self, tree):
+        for category, node in tree.items():
+            self.categories.append(category)
+            color = COLORS.get(category, DEFAULT_COLOR)
+            if isinstance(node, dict):
+                total = self.visit(node, (category,), category, color)
+            else:
+                total = float(node or 0.0)
+                self.subtotals[(category,)] = total
+                self.children[(category,)] = []
+            if category != INFLOW and self.graph is not None:
+                self.graph.add_link(INFLOW, category, total, color)
+        return self
+
+    def visit(self, node, path, root, color):
+        """Post-order visit of a category node, returning its rounded subtotal"""
+        total = 0.0
+        children = []
+        heap = self.heaps.setdefault(root, [])
+        limit = self.top_n.get(root)
+        for label, value in node.items():
+            if isinstance(value, dict):
+                link_value = subtotal = self.visit(value, path + (label,), root, color)
+            else:
+                link_value = value or 0.0
+                subtotal = float(link_value)
+                # Earlier items win ties, as in a stable sort
+                item = (subtotal, -next(self.counter), label)
+                if limit is None or len(heap) < limit:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+            children.append((label, subtotal))
+            total += subtotal
+            if self.graph is not None:
+                if root == INFLOW:
+                    self.graph.add_link(label, path[-1], link_value, color)
+                else:
+                    self.graph.add_link(path[-1], label, link_value, color)
+        total = round(total, 2)
+        self.subtotals[path] = total
+        self.children[path] = children
+        return total
+
+    def subtotal(self, *path):
+        """Subtotal of a category, or zero if the budget does not have it"""
+        return self.subtotals.get(path, 0.0)
+
+    def items(self, *path):
+        """(label, subtotal) of every direct child of a category"""
+        return self.children.get(path, [])
+
+    def top(self, category):
+        """Largest line items of a top-level category, highest first"""
+        ranked = sorted(self.heaps.get(category, []), reverse=True)
+        return {label: value for value, _, label in ranked}
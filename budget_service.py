@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import signal
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+import yaml
+
+import budget_analyzer
+from budget_loader import SafeLoader
+from instrumentation import StageTimer
+
+MAX_BODY_BYTES = 16 * 1024 * 1024
+STATUS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+          413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+          504: "Gateway Timeout"}
+
+def init_worker():
+    """Import plotly and compile the report template once per worker"""
+    import plotly.graph_objects
+    budget_analyzer.load_template()
+
+def warm():
+    return os.getpid()
+
+def sankey_options(options):
+    """Sankey limits from the query parameters sankey_top_n, sankey_min_share and sankey_full"""
+    if options.get("sankey_full", "0").lower() in ("1", "true", "yes"):
+        return {"sankey_top_n": None, "sankey_min_share": None}
+    limits = {}
+    if "sankey_top_n" in options:
+        limits["sankey_top_n"] = int(options["sankey_top_n"])
+    if "sankey_min_share" in options:
+        limits["sankey_min_share"] = float(options["sankey_min_share"])
+    return limits
+
+def analyze_document(kind, document, options):
+    """Analyze a YAML or JSON budget document in a worker, returning (body, content type, stage timings)"""
+    name = options.get("name", "Untitled Budget")
+    timer = StageTimer(name)
+    with timer.stage("yaml_load"):
+        data = yaml.load(document, Loader=SafeLoader)
+    if not isinstance(data, dict):
+        raise ValueError("budget document must be a mapping")
+    budget = budget_analyzer.MonthlyBudget(name, options.get("yml_name", "request"), "", data,
+                                           int(options.get("tax_year", 2023)),
+                                           options.get("filing_status", "married_filing_jointly"),
+                                           options.get("state", "colorado"), use_cache=False, timer=timer,
+                                           **sankey_options(options))
+    # Stage timings go in the Server-Timing header rather than the analytics
+    budget.data["analytics"].pop("timings")
+    if kind == "analytics":
+        body, content_type = json.dumps(budget.data["analytics"]), "application/json"
+    elif kind == "sankey":
+        with timer.stage("build_figure"):
+            fig = budget.build_figure()
+        with timer.stage("html_export"):
+            # Load plotly.js from the CDN, which browsers cache, rather than inlining 4.8 MB per response
+            body, content_type = fig.to_html(include_plotlyjs="cdn"), "text/html; charset=utf-8"
+    else:
+        body, content_type = budget.report_markdown(), "text/markdown; charset=utf-8"
+    return body.encode(), content_type, [(r["stage"], r["wall"]) for r in timer.records]
+
+class BudgetService():
+    """Local HTTP API over a bounded pool of pre-warmed analysis workers
+
+    POST a budget document (YAML or JSON) to /analytics, /sankey or /report, with optional
+    name, tax_year, filing_status, state and Sankey limit query parameters. Jobs in the pool,
+    including ones whose requests timed out, hold one of max_pending slots until they finish;
+    requests beyond that are turned away with 503 rather than queued without bound. Every
+    response carries a Server-Timing header with the queue wait, each analysis stage and the total.
+    """
+    ENDPOINTS = ("analytics", "sankey", "report")
+
+    def __init__(self, workers=2, max_pending=None, timeout=30.0):
+        self.workers = workers
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+        self.slots = asyncio.Semaphore(max_pending or workers * 4)
+        self.timeout = timeout
+
+    async def start(self):
+        """Spawn and warm every worker before accepting requests"""
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*[loop.run_in_executor(self.pool, warm) for _ in range(self.workers)])
+        print("INFO: {} workers ready ({}).".format(len(set(pids)), ", ".join(map(str, sorted(set(pids))))))
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    async def handle(self, reader, writer):
+        start = time.perf_counter()
+        method, target = "-", "-"
+        try:
+            request_line = await reader.readline()
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY_BYTES:
+                status, body, content_type, timings = self.error(413, "budget document too large")
+            else:
+                body = await reader.readexactly(length) if length else b""
+                status, body, content_type, timings = await self.dispatch(method, target, body)
+        except (ValueError, asyncio.IncompleteReadError):
+            status, body, content_type, timings = self.error(400, "malformed request")
+        total = time.perf_counter() - start
+        timings.append(("total", total))
+        server_timing = ", ".join("{};dur={:.2f}".format(stage, seconds * 1000) for stage, seconds in timings)
+        head = ["HTTP/1.1 {} {}".format(status, STATUS[status]),
+                "Content-Type: " + content_type,
+                "Content-Length: {}".format(len(body)),
+                "Server-Timing: " + server_timing,
+                "Connection: close"]
+        if status == 503:
+            head.append("Retry-After: 1")
+        try:
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+        print("INFO: {} {} {} {:.1f}ms".format(method, target, status, total * 1000), flush=True)
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        endpoint = url.path.strip("/")
+        if endpoint == "health":
+            return 200, json.dumps({"status": "ok", "workers": self.workers}).encode(), "application/json", []
+        if endpoint not in self.ENDPOINTS:
+            return self.error(404, "unknown endpoint /" + endpoint)
+        if method != "POST":
+            return self.error(405, "POST a budget document to /" + endpoint)
+        if self.slots.locked():
+            return self.error(503, "too many pending requests")
+        options = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        await self.slots.acquire()
+        queued = time.perf_counter()
+        job = asyncio.get_running_loop().run_in_executor(self.pool, analyze_document, endpoint, body, options)
+        # A timed-out job keeps its worker busy, so its slot is only released once it really finishes
+        job.add_done_callback(self.release)
+        try:
+            body, content_type, timings = await asyncio.wait_for(asyncio.shield(job), self.timeout)
+        except asyncio.TimeoutError:
+            return self.error(504, "analysis timed out")
+        except (yaml.YAMLError, ValueError, KeyError, TypeError, ZeroDivisionError) as e:
+            return self.error(400, "{}: {}".format(type(e).__name__, e))
+        except Exception as e:
+            return self.error(500, "{}: {}".format(type(e).__name__, e))
+        # Time spent waiting for and handing the document to a worker, then each stage within it
+        busy = sum(seconds for _, seconds in timings)
+        return 200, body, content_type, [("queue", max(0.0, time.perf_counter() - queued - busy))] + timings
+
+    def release(self, job):
+        if not job.cancelled():
+            # Mark the outcome of an abandoned job as retrieved
+            job.exception()
+        self.slots.release()
+
+    def error(self, status, message):
+        return status, json.dumps({"error": message}).encode(), "application/json", []
+
+async def serve(args):
+    service = BudgetService(args.workers, args.max_pending, args.timeout)
+    await service.start()
+    if args.socket:
+        server = await asyncio.start_unix_server(service.handle, path=args.socket)
+        print("INFO: Serving on unix:{}".format(args.socket), flush=True)
+    else:
+        server = await asyncio.start_server(service.handle, args.host, args.port)
+        print("INFO: Serving on http://{}:{}".format(args.host, args.port), flush=True)
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    try:
+        async with server:
+            await stop.wait()
+    finally:
+        service.close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+    print("INFO: Shutting down.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default="127.0.0.1",
+                        help="Address to listen on")
+    parser.add_argument('--port', type=int, default=8765,
+                        help="TCP port to listen on")
+    parser.add_argument('-s', '--socket', type=str, default=None,
+                        help="Listen on this Unix socket instead of TCP")
+    parser.add_argument('-w', '--workers', type=int, default=2,
+                        help="Number of pre-warmed worker processes")
+    parser.add_argument('-q', '--max-pending', type=int, default=None,
+                        help="Requests in flight before new ones get 503 (defaults to 4 per worker)")
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help="Seconds before an analysis is abandoned with 504")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("INFO: Shutting down.")
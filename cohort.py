@@ -0,0 +1,277 @@
+import os
+import sys
+import math
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import budget_analyzer
+from batch_analyzer import find_budgets
+from budget_loader import load_budget, prune_cache
+from sankey_graph import SankeyGraph
+
+COHORT_METRICS = ("savings_rate", "debt_income_ratio", "mortgage_income_ratio", "effective_tax_rate")
+# Line items named after household members, folded into one node so cohort links do not grow per person
+PERSONAL_ITEMS = {"Earned Income": "Wages", "Retirement": "Retirement Accounts"}
+PAYROLL_TAXES = ((" Oasdi Tax", "OASDI Tax"), (" Med Tax", "Medicare Tax"))
+
+class QuantileSketch():
+    """Mergeable quantile sketch with relative accuracy, after DDSketch
+
+    Values fall into logarithmic buckets, so every quantile is within relative_accuracy of a
+    value of the data, and two sketches merge by adding their bucket counts. The number of
+    buckets grows with the log of the value range rather than the number of values, and is
+    capped at max_buckets by collapsing the buckets nearest zero.
+    """
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def key(self, value):
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def add(self, value):
+        if value is None or not math.isfinite(value):
+            return
+        if value > 0:
+            buckets, key = self.positive, self.key(value)
+        elif value < 0:
+            buckets, key = self.negative, self.key(-value)
+        else:
+            self.zeros += 1
+            buckets = None
+        if buckets is not None:
+            buckets[key] = buckets.get(key, 0) + 1
+            if len(buckets) > self.max_buckets:
+                self.collapse(buckets)
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def collapse(self, buckets):
+        """Fold the buckets nearest zero together until max_buckets remain"""
+        keys = sorted(buckets)
+        excess = keys[:len(keys) - self.max_buckets + 1]
+        buckets[excess[-1]] += sum(buckets.pop(key) for key in excess[:-1])
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches of different relative accuracy")
+        for mine, theirs in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in theirs.items():
+                mine[key] = mine.get(key, 0) + count
+            if len(mine) > self.max_buckets:
+                self.collapse(mine)
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def value(self, key):
+        """Representative value of a bucket, within relative_accuracy of anything in it"""
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        return min(max(self.bucket_quantile(q), self.min), self.max)
+
+    def bucket_quantile(self, q):
+        """Representative value of the bucket holding the q-quantile, before clamping to the data range"""
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self.value(key)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self.value(key)
+        return self.max
+
+    def summary(self, percentiles):
+        if not self.count:
+            return {"count": 0}
+        summary = {"p{:g}".format(p): self.quantile(p / 100) for p in percentiles}
+        summary.update(mean=self.total / self.count, min=self.min, max=self.max, count=self.count)
+        return summary
+
+class CohortSummary():
+    """Streaming summary of many budgets: metric and category sketches plus summed Sankey links
+
+    Summaries of separate chunks of budgets merge into one, so a cohort is reduced without
+    ever holding more than one budget's analytics at a time. Category sketches are kept for
+    top-level categories and their nested subcategories, and per-person line items like
+    salaries, payroll taxes and retirement accounts are summed into shared nodes, so the
+    summary grows with the number of distinct categories rather than households.
+    """
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.budgets = 0
+        self.errors = []
+        self.metrics = {metric: QuantileSketch(relative_accuracy) for metric in COHORT_METRICS}
+        self.categories = {}
+        self.links = {}
+
+    def sketch(self, category):
+        if category not in self.categories:
+            self.categories[category] = QuantileSketch(self.relative_accuracy)
+        return self.categories[category]
+
+    def add(self, budget):
+        analytics = budget.data["analytics"]
+        self.budgets += 1
+        for metric, sketch in self.metrics.items():
+            sketch.add(analytics.get(metric))
+        # Spend of every outflow category and each of its subcategories, but not its line items
+        for category in budget.rollup.categories:
+            if category == "Income":
+                continue
+            self.sketch(category).add(budget.rollup.subtotal(category))
+            for subcategory, subtotal in budget.rollup.items(category):
+                if (category, subcategory) in budget.rollup.subtotals:
+                    self.sketch(category + " / " + subcategory).add(subtotal)
+        groups = {path[-1] for path in budget.rollup.subtotals}
+        links = budget.graph.links()
+        labels = budget.graph.node_labels
+        for s, t, v, c in zip(links["source"], links["target"], links["value"], links["color"]):
+            entry = self.links.setdefault(self.cohort_link(labels[s], labels[t], groups), [0.0, c])
+            entry[0] += v
+
+    @staticmethod
+    def cohort_link(source, target, groups):
+        """Link endpoints with per-person line items replaced by their shared node"""
+        if target in PERSONAL_ITEMS and source not in groups:
+            source = PERSONAL_ITEMS[target]
+        elif source in PERSONAL_ITEMS and target not in groups:
+            target = PERSONAL_ITEMS[source]
+        elif source == "Taxes":
+            for suffix, label in PAYROLL_TAXES:
+                if target.endswith(suffix):
+                    target = label
+        return source, target
+
+    def merge(self, other):
+        self.budgets += other.budgets
+        self.errors += other.errors
+        for metric, sketch in other.metrics.items():
+            self.metrics[metric].merge(sketch)
+        for category, sketch in other.categories.items():
+            self.sketch(category).merge(sketch)
+        for pair, (value, color) in other.links.items():
+            entry = self.links.setdefault(pair, [0.0, color])
+            entry[0] += value
+        return self
+
+    def graph(self):
+        """Consolidated Sankey graph of the cohort's combined monthly money flow"""
+        graph = SankeyGraph()
+        for (source, target), (value, color) in self.links.items():
+            graph.add_link(source, target, round(value, 2), color)
+        return graph
+
+    def report(self, percentiles=(5, 25, 50, 75, 95)):
+        return {"budgets": self.budgets, "errors": len(self.errors),
+                "metrics": {metric: sketch.summary(percentiles) for metric, sketch in self.metrics.items()},
+                "categories": {category: sketch.summary(percentiles) for category, sketch in self.categories.items()}}
+
+def summarize_chunk(paths, tax_args, relative_accuracy):
+    """Analyze a chunk of budgets in a worker, reducing them to one CohortSummary"""
+    summary = CohortSummary(relative_accuracy)
+    for path in paths:
+        try:
+            data = load_budget(path)
+            budget = budget_analyzer.MonthlyBudget(budget_analyzer.budget_name(path), path, "", data,
+                                                   *tax_args, use_cache=False)
+        except Exception as e:
+            summary.errors.append("{}: {}: {}".format(path, type(e).__name__, e))
+            continue
+        summary.add(budget)
+    return summary
+
+def run_cohort(paths, workers=None, chunk_size=100, tax_args=(2023, "married_filing_jointly", "colorado"),
+               relative_accuracy=0.01):
+    """Map chunks of budgets over a process pool and merge their summaries as they finish
+
+    At most two chunks per worker are in flight, so memory stays flat however many budgets there are.
+    """
+    chunks = (paths[start:start + chunk_size] for start in range(0, len(paths), chunk_size))
+    total = CohortSummary(relative_accuracy)
+    limit = 2 * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for chunk in chunks:
+            pending.add(pool.submit(summarize_chunk, chunk, tax_args, relative_accuracy))
+            if len(pending) >= limit:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    total.merge(future.result())
+        for future in pending:
+            total.merge(future.result())
+    return total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', type=str, nargs='+', required=True,
+                        help="Directories or glob patterns of input YAML budget files")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help="Number of worker processes (defaults to the CPU count)")
+    parser.add_argument('-c', '--chunk-size', type=int, default=100,
+                        help="Budgets analyzed per worker task")
+    parser.add_argument('-p', '--percentiles', type=float, nargs='+', default=[5, 25, 50, 75, 95],
+                        help="Percentiles to report for each metric and category")
+    parser.add_argument('-r', '--relative-accuracy', type=float, default=0.01,
+                        help="Relative accuracy of the percentile sketches")
+    parser.add_argument('--tax-year', type=int, default=2023,
+                        help="Tax year of the bracket tables in tax_tables/")
+    parser.add_argument('--filing-status', type=str, default="married_filing_jointly",
+                        choices=["married_filing_jointly", "single", "head_of_household"],
+                        help="Federal filing status")
+    parser.add_argument('--state', type=str, default="colorado",
+                        help="State income tax table")
+    parser.add_argument('-s', '--sankey', type=str, default=None,
+                        help="Write the consolidated cohort Sankey diagram to this HTML file")
+    parser.add_argument('--sankey-top-n', type=int, default=budget_analyzer.SANKEY_TOP_N,
+                        help="Line items kept per category of the cohort Sankey, the rest are folded into an \"Other\" node")
+    parser.add_argument('--sankey-min-share', type=float, default=budget_analyzer.SANKEY_MIN_SHARE,
+                        help="Fold Sankey line items below this fraction of their category into an \"Other\" node")
+    parser.add_argument('--sankey-full', action='store_true',
+                        help="Draw every line item in the Sankey diagram")
+    args = parser.parse_args()
+    if args.sankey_full:
+        args.sankey_top_n = args.sankey_min_share = None
+
+    paths = find_budgets(args.input)
+    if not paths:
+        sys.exit("ERROR: No budget files found.")
+    # Drop the cached trees of budgets that have since been moved or deleted
+    prune_cache()
+    summary = run_cohort(paths, args.workers, args.chunk_size,
+                         (args.tax_year, args.filing_status, args.state), args.relative_accuracy)
+    for error in summary.errors:
+        print("ERROR: " + error, file=sys.stderr)
+    if args.sankey:
+        graph = summary.graph()
+        if not args.sankey_full:
+            graph = graph.reduce(args.sankey_top_n, args.sankey_min_share)
+        budget_analyzer.sankey_figure(graph, "Cohort Monthly Budget ({} households)".format(
+            summary.budgets)).write_html(args.sankey)
+        print("INFO: Wrote the cohort Sankey diagram to {}.".format(args.sankey), file=sys.stderr)
+    json.dump(summary.report(args.percentiles), sys.stdout, indent=2)
+    print()
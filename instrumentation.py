@@ -0,0 +1,95 @@
+import os
+import io
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PAGE_KB = os.sysconf("SC_PAGE_SIZE") // 1024 if hasattr(os, "sysconf") else 4
+
+def current_rss_kb():
+    """Resident set size of this process in KB, or None where /proc is not available"""
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * PAGE_KB
+    except (OSError, ValueError, IndexError):
+        return None
+
+class StageTimer():
+    """Records wall time, CPU time and memory of each named stage of a budget run
+
+    Records are plain dicts, appended to self.records and optionally written to sink as NDJSON.
+    Each carries the change in the process's RSS over the stage where /proc is available, and
+    the process's peak RSS so far, which a stage only raises by outgrowing everything before it.
+    Neither is the stage's own peak: with profile=True every stage also runs under cProfile and
+    tracemalloc, adding its peak traced memory and top functions to its record, and dumping the
+    raw profile to profile_dir when one is given.
+    """
+    def __init__(self, budget=None, sink=None, profile=False, profile_dir=None, top=15):
+        self.budget = budget
+        self.sink = sink
+        self.profile = profile
+        self.profile_dir = profile_dir
+        self.top = top
+        self.records = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        profiler = None
+        if self.profile:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            profiler = cProfile.Profile()
+            profiler.enable()
+        rss = current_rss_kb()
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            record = {"budget": self.budget, "stage": name,
+                      "wall": time.perf_counter() - wall, "cpu": time.thread_time() - cpu}
+            if rss is not None:
+                # Memory the process gained or released while the stage ran
+                record["rss_delta_kb"] = current_rss_kb() - rss
+            if resource is not None:
+                # ru_maxrss is the high-water mark of the whole process so far, not of this stage
+                max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                record["process_max_rss_kb"] = max_rss // 1024 if sys.platform == "darwin" else max_rss
+            if profiler is not None:
+                profiler.disable()
+                record["peak_traced_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+                record["profile"] = self.top_functions(profiler)
+                if self.profile_dir:
+                    os.makedirs(self.profile_dir, exist_ok=True)
+                    base_name = (self.budget or "budget").replace(" ", "_").lower()
+                    profiler.dump_stats(os.path.join(self.profile_dir, "{}_{}.prof".format(base_name, name)))
+            self.emit(record)
+
+    def top_functions(self, profiler):
+        """The functions with the highest cumulative time in a profile, as text lines"""
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(self.top)
+        return [line for line in out.getvalue().splitlines() if line.strip()]
+
+    def emit(self, record):
+        with self.lock:
+            self.records.append(record)
+            if self.sink is not None:
+                self.sink.write(json.dumps(record) + "\n")
+                self.sink.flush()
+
+    def summary(self):
+        """Wall and CPU seconds per stage, without the profile details"""
+        return [{k: v for k, v in record.items() if k != "profile"} for record in self.records]
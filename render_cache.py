@@ -0,0 +1,153 @@
+import os
+import json
+import shutil
+import threading
+import hashlib
+import functools
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+@functools.lru_cache(maxsize=None)
+def _file_digest(path, mtime_ns, size):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def file_digest(path):
+    """Hash of a file's contents, memoized on its path, mtime and size"""
+    stat = os.stat(path)
+    return _file_digest(path, stat.st_mtime_ns, stat.st_size)
+
+def normalize(value):
+    """Normalize nested budget values so equal amounts hash alike, e.g. 50 and 50.0"""
+    if isinstance(value, dict):
+        return {str(k): normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+def content_key(*parts, files=()):
+    """Hash JSON-normalized values together with the contents of files"""
+    sha = hashlib.sha256()
+    sha.update(json.dumps(normalize(parts), sort_keys=True, default=str).encode())
+    for path in files:
+        sha.update(file_digest(path).encode())
+    return sha.hexdigest()
+
+class BlobStore():
+    """Bounded store of rendered artifacts by content key, shared by every budget of an output root
+
+    Each copy is a file named after its key, so concurrent batch workers share the store without
+    a common index. A copy's mtime marks its last use, and copies are evicted least recently used
+    first once they exceed max_bytes.
+    """
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.dir = directory
+        self.max_bytes = max_bytes
+
+    def path(self, key, ext):
+        return os.path.join(self.dir, key + ext)
+
+    def get(self, key, path):
+        """Copy the stored rendering of key to path, returning whether one was available"""
+        blob = self.path(key, os.path.splitext(path)[1])
+        try:
+            shutil.copyfile(blob, path)
+            os.utime(blob)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, path, key):
+        """Keep a copy of the artifact at path under key, unless one is already stored"""
+        blob = self.path(key, os.path.splitext(path)[1])
+        try:
+            os.utime(blob)
+            return
+        except FileNotFoundError:
+            pass
+        os.makedirs(self.dir, exist_ok=True)
+        tmp_file = "{}.{}.tmp".format(blob, os.getpid())
+        shutil.copyfile(path, tmp_file)
+        os.replace(tmp_file, blob)
+        self.evict()
+
+    def evict(self):
+        """Drop least recently used copies until the store fits in max_bytes"""
+        blobs = []
+        for entry in os.scandir(self.dir):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in blobs)
+        for _, size, blob in sorted(blobs):
+            if total <= self.max_bytes:
+                break
+            total -= size
+            try:
+                os.remove(blob)
+            except FileNotFoundError:
+                pass
+
+class RenderCache():
+    """Content-hash cache of rendered artifacts in a budget output directory
+
+    The index records the key each artifact was last rendered from, so unchanged artifacts
+    are skipped outright. Renderings are also kept by key in a BlobStore, so a budget that
+    changes back to an earlier state is restored without rendering.
+    """
+    def __init__(self, directory, blobs):
+        self.dir = os.path.join(directory, '.cache')
+        self.index_file = os.path.join(self.dir, 'index.json')
+        self.blobs = blobs
+        self.lock = threading.Lock()
+        try:
+            with open(self.index_file, 'r') as f:
+                self.index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.index = {"artifacts": {}}
+
+    def fresh(self, path, key):
+        """Whether the artifact at path was rendered from key and is still on disk unchanged"""
+        entry = self.index["artifacts"].get(os.path.basename(path))
+        if not entry or entry["key"] != key:
+            return False
+        try:
+            return os.path.getsize(path) == entry["size"]
+        except OSError:
+            return False
+
+    def restore(self, path, key):
+        """Copy a stored rendering of key to path, returning whether one was available"""
+        if not self.blobs.get(key, path):
+            return False
+        with self.lock:
+            self._record(path, key)
+        return True
+
+    def store(self, path, key, keep=True):
+        """Record a freshly rendered artifact, keeping a copy of it under key if there is none
+
+        Artifacts that can never be rendered from the same key again are recorded without a copy.
+        """
+        if keep:
+            self.blobs.put(path, key)
+        with self.lock:
+            self._record(path, key)
+
+    def save(self):
+        """Atomically write the cache index"""
+        os.makedirs(self.dir, exist_ok=True)
+        tmp_file = self.index_file + ".tmp"
+        with self.lock:
+            with open(tmp_file, 'w') as f:
+                json.dump(self.index, f)
+            os.replace(tmp_file, self.index_file)
+
+    def _record(self, path, key):
+        self.index["artifacts"][os.path.basename(path)] = {"key": key, "size": os.path.getsize(path)}
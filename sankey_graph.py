@@ -0,0 +1,178 @@
+from array import array
+from collections import deque
+
+class SankeyGraph():
+    """Indexed Sankey graph with array-backed link columns"""
+    def __init__(self):
+        self.node_labels = []
+        self.node_index = {}
+        self.colors = []
+        self.color_index = {}
+        self.link_source = array('l')
+        self.link_target = array('l')
+        self.link_value = array('d')
+        self.link_color = array('l')
+
+    def __len__(self):
+        return len(self.link_value)
+
+    def node(self, label):
+        """Return the index of a node, adding it on first use"""
+        index = self.node_index.get(label)
+        if index is None:
+            index = len(self.node_labels)
+            self.node_index[label] = index
+            self.node_labels.append(label)
+        return index
+
+    def add_link(self, source, target, value, color):
+        """Append a link between two labelled nodes"""
+        color_id = self.color_index.get(color)
+        if color_id is None:
+            color_id = len(self.colors)
+            self.color_index[color] = color_id
+            self.colors.append(color)
+        self.link_source.append(self.node(source))
+        self.link_target.append(self.node(target))
+        self.link_value.append(value)
+        self.link_color.append(color_id)
+
+    def links(self):
+        """Link columns in the form expected by go.Sankey"""
+        return dict(source = self.link_source.tolist(),
+                    target = self.link_target.tolist(),
+                    value = self.link_value.tolist(),
+                    color = [self.colors[i] for i in self.link_color])
+
+    def node_depths(self):
+        """Depth of every node, measured as the longest path from a node with no inflows"""
+        n = len(self.node_labels)
+        children = [[] for _ in range(n)]
+        indegree = array('l', [0]) * n
+        for s, t in zip(self.link_source, self.link_target):
+            children[s].append(t)
+            indegree[t] += 1
+        depth = array('l', [0]) * n
+        queue = deque(i for i in range(n) if indegree[i] == 0)
+        while queue:
+            s = queue.popleft()
+            for t in children[s]:
+                if depth[s] + 1 > depth[t]:
+                    depth[t] = depth[s] + 1
+                indegree[t] -= 1
+                if indegree[t] == 0:
+                    queue.append(t)
+        return depth
+
+    def node_values(self):
+        """Throughput of every node, the larger of its total inflow and outflow"""
+        n = len(self.node_labels)
+        inflow = array('d', [0.0]) * n
+        outflow = array('d', [0.0]) * n
+        for s, t, v in zip(self.link_source, self.link_target, self.link_value):
+            outflow[s] += v
+            inflow[t] += v
+        return [max(i, o) for i, o in zip(inflow, outflow)]
+
+    def layout(self):
+        """Compute node x/y positions from node depth and throughput"""
+        depth = self.node_depths()
+        max_depth = max(depth, default=0) or 1
+        node_x = [d / max_depth for d in depth]
+
+        # Stack nodes in each column in insertion order, centred on their share of the column total
+        values = self.node_values()
+        totals = {}
+        for d, v in zip(depth, values):
+            totals[d] = totals.get(d, 0.0) + v
+        filled = {}
+        node_y = []
+        for d, v in zip(depth, values):
+            top = filled.get(d, 0.0)
+            filled[d] = top + v
+            y = (top + v / 2) / totals[d] if totals[d] else 0.5
+            node_y.append(min(max(y, 0.001), 0.999))
+        node_x = [min(max(x, 0.001), 0.999) for x in node_x]
+        return node_x, node_y
+
+    def reduce(self, top_n=None, min_share=None):
+        """Copy of the graph with each parent's smallest branches folded into an "Other <parent>" node
+
+        Below a node with a single inflow its outflows branch out, like Expenses into its categories,
+        and above a node with a single outflow its inflows branch in, like salaries into Earned Income.
+        Branches beyond a parent's top_n largest, or below min_share of the parent's throughput, are
+        folded into one link of their total, so every parent keeps its total. Only branches that are
+        trees are folded, and a hub with several inflows and outflows keeps all of its branches.
+        Returns the graph itself if nothing folds.
+        """
+        n = len(self.node_labels)
+        inflows = [[] for _ in range(n)]
+        outflows = [[] for _ in range(n)]
+        for i, (s, t) in enumerate(zip(self.link_source, self.link_target)):
+            outflows[s].append(i)
+            inflows[t].append(i)
+
+        def branch(node, down):
+            """Nodes of the branch from a node away from its parent, or None if it is not a tree"""
+            nodes = [node]
+            for m in nodes:
+                for i in (outflows[m] if down else inflows[m]):
+                    child = self.link_target[i] if down else self.link_source[i]
+                    if len(inflows[child] if down else outflows[child]) != 1:
+                        return None
+                    nodes.append(child)
+            return nodes
+
+        values = self.node_values()
+        folded = {}
+        removed = set()
+        for parent in range(n):
+            for down in (True, False):
+                if len(inflows[parent] if down else outflows[parent]) > 1:
+                    continue
+                ranked = sorted(outflows[parent] if down else inflows[parent], key=lambda i: -self.link_value[i])
+                fold = []
+                for rank, i in enumerate(ranked):
+                    if (top_n is not None and rank >= top_n) or \
+                       (min_share is not None and self.link_value[i] < min_share * values[parent]):
+                        nodes = branch(self.link_target[i] if down else self.link_source[i], down)
+                        if nodes is not None:
+                            fold.append((i, nodes))
+                # Folding a single branch would only rename it
+                if len(fold) > 1:
+                    for i, nodes in fold:
+                        folded[i] = (parent, down)
+                        removed.update(nodes)
+        if not folded:
+            return self
+        totals = {}
+        counts = {}
+        for i, group in folded.items():
+            if group[0] not in removed:
+                totals[group] = totals.get(group, 0.0) + self.link_value[i]
+                counts[group] = counts.get(group, 0) + 1
+
+        # Each group's "Other" link takes the place of the first link folded into it
+        graph = SankeyGraph()
+        for i, (s, t, v, c) in enumerate(zip(self.link_source, self.link_target, self.link_value, self.link_color)):
+            group = folded.get(i)
+            if group in totals:
+                parent = self.node_labels[group[0]]
+                value = round(totals.pop(group), 2)
+                other = self.other_label(parent, counts[group])
+                if group[1]:
+                    graph.add_link(parent, other, value, self.colors[c])
+                else:
+                    graph.add_link(other, parent, value, self.colors[c])
+            elif s not in removed and t not in removed:
+                graph.add_link(self.node_labels[s], self.node_labels[t], v, self.colors[c])
+        return graph
+
+    def other_label(self, parent, count):
+        """Label of the node a parent's folded branches merge into, distinct from every existing node"""
+        label = "Other " + parent
+        if label in self.node_index:
+            label = "Other {} ({} items)".format(parent, count)
+        while label in self.node_index:
+            label = "Other " + label
+        return label
@@ -0,0 +1,166 @@
+import sys
+import json
+import argparse
+import yaml
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from tax_engine import load_tax_table, compute_taxes
+from budget_loader import load_yaml, flatten_leaves, normalize_key
+
+METRICS = ("net_gain_loss", "savings_rate", "debt_income_ratio", "fi_number", "effective_tax_rate")
+DISTRIBUTIONS = {
+    "uniform": lambda rng, p, n: rng.uniform(p["low"], p["high"], n),
+    "normal": lambda rng, p, n: rng.normal(p["mean"], p["std"], n),
+    "lognormal": lambda rng, p, n: rng.lognormal(p["mean"], p["sigma"], n),
+    "triangular": lambda rng, p, n: rng.triangular(p["left"], p["mode"], p["right"], n),
+}
+
+class BudgetModel():
+    """Leaf item vector of a base budget and the column groups the analytics sum over"""
+    def __init__(self, data, tax_table):
+        tree = {normalize_key(k): v for k, v in data.items()}.get("monthly_budget", data)
+        leaves = list(flatten_leaves(tree))
+        self.paths = [path for path, _ in leaves]
+        self.base = np.array([value for _, value in leaves], dtype=float)
+        self.tax_table = tax_table
+        self.income = self.columns(("income",))
+        self.earned = self.columns(("income", "earned_income"))
+        self.expenses = self.columns(("expenses",))
+        self.retirement = self.columns(("retirement",))
+        self.savings = self.columns(("savings",))
+        # Every other top-level category, e.g. giving, is an outflow like savings
+        standard = ("income", "expenses", "retirement", "savings")
+        self.outflows = [i for i, path in enumerate(self.paths) if path[0] not in standard]
+        home = ("expenses", "home_expenses")
+        self.debt = self.columns(home + ("mortgage",)) + self.columns(home + ("real_estate_tax",)) + \
+                    self.columns(home + ("homeowners_insurance",)) + \
+                    self.columns(("expenses", "vehicle_expenses", "car_loan"))
+        # Income that is not a salary or bonus is business income and pays double FICA
+        self.self_employed = np.array(["salary" not in self.paths[i][-1] and "bonus" not in self.paths[i][-1]
+                                       for i in self.earned], dtype=bool)
+
+    def columns(self, prefix):
+        """Indices of every leaf under a category path"""
+        return [i for i, path in enumerate(self.paths) if path[:len(prefix)] == prefix]
+
+    def analyze(self, items):
+        """Compute the budget metrics for a (scenarios, leaves) matrix of line items"""
+        income = np.round(items[:, self.income].sum(axis=1), 2)
+        expenses = np.round(items[:, self.expenses].sum(axis=1), 2)
+        retirement = np.round(items[:, self.retirement].sum(axis=1), 2)
+        savings = np.round(items[:, self.savings].sum(axis=1), 2)
+        outflows = np.round(items[:, self.outflows].sum(axis=1), 2)
+        taxes = compute_taxes(self.tax_table, income, items[:, self.earned], self.self_employed)
+        total_taxes = np.round(taxes["federal"], 2) + np.round(taxes["state"] + taxes["famli"], 2) + \
+                      np.round(taxes["oasdi_total"], 2) + np.round(taxes["medicare_total"], 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return {
+                "net_gain_loss": income - expenses - total_taxes - retirement - savings - outflows,
+                "savings_rate": (savings + retirement) / income,
+                "debt_income_ratio": items[:, self.debt].sum(axis=1) / income * 100,
+                "fi_number": expenses * 12 * 25,
+                "effective_tax_rate": total_taxes / income,
+            }
+
+class ScenarioSpec():
+    """Parameter sweeps and distributions applied to leaf items or whole categories"""
+    def __init__(self, model, parameters):
+        self.sweeps = []
+        self.draws = []
+        for path, spec in parameters.items():
+            prefix = tuple(normalize_key(key) for key in path.split("."))
+            cols = model.columns(prefix)
+            if not cols:
+                raise KeyError("No budget items match parameter '{}'".format(path))
+            mode = spec.get("mode", "scale")
+            if mode not in ("scale", "add", "set"):
+                raise ValueError("Unknown mode '{}' for parameter '{}'".format(mode, path))
+            if "sweep" in spec:
+                values = np.linspace(spec["sweep"][0], spec["sweep"][1], spec.get("steps", 11))
+                self.sweeps.append((cols, mode, values))
+            elif spec.get("distribution") in DISTRIBUTIONS:
+                self.draws.append((cols, mode, spec))
+            else:
+                raise ValueError("Parameter '{}' needs a sweep range or a known distribution".format(path))
+        self.grid_shape = tuple(len(values) for _, _, values in self.sweeps)
+        self.grid_size = int(np.prod(self.grid_shape)) if self.sweeps else 1
+
+    @staticmethod
+    def apply(items, cols, mode, values):
+        values = values[:, np.newaxis]
+        if mode == "scale":
+            items[:, cols] *= values
+        elif mode == "add":
+            items[:, cols] += values
+        else:
+            items[:, cols] = values
+
+    def build(self, model, start, stop, samples, rng):
+        """Line item matrix for scenario rows [start, stop) of the grid x samples space"""
+        rows = np.arange(start, stop)
+        items = np.tile(model.base, (len(rows), 1))
+        if self.sweeps:
+            grid_index = np.unravel_index(rows // samples, self.grid_shape)
+            for (cols, mode, values), index in zip(self.sweeps, grid_index):
+                self.apply(items, cols, mode, values[index])
+        for cols, mode, spec in self.draws:
+            self.apply(items, cols, mode, DISTRIBUTIONS[spec["distribution"]](rng, spec, len(rows)))
+        return items
+
+def run_chunk(data, parameters, tax_args, start, stop, samples, seed):
+    """Evaluate one chunk of scenarios, returning the metric arrays"""
+    model = BudgetModel(data, load_tax_table(*tax_args))
+    spec = ScenarioSpec(model, parameters)
+    items = spec.build(model, start, stop, samples, np.random.default_rng(seed))
+    return model.analyze(items)
+
+def run_scenarios(data, parameters, samples=1000, seed=None, workers=None, chunk_size=10000,
+                  tax_year=2023, filing_status="married_filing_jointly", state="colorado"):
+    """Evaluate every sweep grid point with the given number of random samples, spread across processes"""
+    tax_args = (tax_year, filing_status, state)
+    spec = ScenarioSpec(BudgetModel(data, load_tax_table(*tax_args)), parameters)
+    samples = samples if spec.draws else 1
+    total = spec.grid_size * samples
+    bounds = [(start, min(start + chunk_size, total)) for start in range(0, total, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(bounds))
+    if len(bounds) == 1:
+        chunks = [run_chunk(data, parameters, tax_args, *bounds[0], samples, seeds[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run_chunk, data, parameters, tax_args, start, stop, samples, s)
+                       for (start, stop), s in zip(bounds, seeds)]
+            chunks = [future.result() for future in futures]
+    return {metric: np.concatenate([chunk[metric] for chunk in chunks]) for metric in METRICS}
+
+def summarize(results, percentiles=(5, 25, 50, 75, 95)):
+    """Percentile summary of every metric across all scenarios"""
+    summary = {"scenarios": int(len(results[METRICS[0]]))}
+    for metric, values in results.items():
+        values = values[np.isfinite(values)]
+        summary[metric] = {"p{:g}".format(p): float(v) for p, v in zip(percentiles, np.percentile(values, percentiles))}
+        summary[metric]["mean"] = float(values.mean())
+    summary["net_loss_probability"] = float((results["net_gain_loss"] < 0).mean())
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', type=str, required=True,
+                        help="Input YAML file containing the base monthly budget")
+    parser.add_argument('-s', '--scenarios', type=str, required=True,
+                        help="YAML file of parameter sweeps and distributions")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help="Number of worker processes (defaults to the CPU count)")
+    parser.add_argument('-p', '--percentiles', type=float, nargs='+', default=[5, 25, 50, 75, 95],
+                        help="Percentiles to report for each metric")
+    args = parser.parse_args()
+
+    data = load_yaml(args.input)
+    with open(args.scenarios, 'r') as yml:
+        config = yaml.safe_load(yml)
+    results = run_scenarios(data, config["parameters"], config.get("samples", 1000), config.get("seed"),
+                            args.workers, tax_year=config.get("tax_year", 2023),
+                            filing_status=config.get("filing_status", "married_filing_jointly"),
+                            state=config.get("state", "colorado"))
+    json.dump(summarize(results, args.percentiles), sys.stdout, indent=2)
+    print()
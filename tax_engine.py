@@ -0,0 +1,93 @@
+import os
+import functools
+import numpy as np
+import yaml
+
+TAX_TABLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tax_tables')
+
+class TaxTable():
+    """Monthly bracket arrays for one tax year, filing status and state"""
+    def __init__(self, year, filing_status, state, table):
+        federal = table['federal'][filing_status]
+        self.year = year
+        self.filing_status = filing_status
+        self.state = state
+        self.standard_deduction = federal['standard_deduction'] / 12
+        self.child_tax_credit = table['child_tax_credit'] / 12
+
+        # Upper bound of every bracket, and the lower bound and tax owed at the bottom of each bracket
+        self.thresholds = np.asarray(federal['thresholds'], dtype=float) / 12
+        self.rates = np.asarray(federal['rates'], dtype=float)
+        self.lower_bounds = np.concatenate(([0.0], self.thresholds))
+        self.base_amounts = np.concatenate(([0.0], np.cumsum(np.diff(self.lower_bounds) * self.rates[:-1])))
+
+        self.oasdi_rate = table['fica']['oasdi_rate']
+        self.oasdi_wage_base = table['fica']['oasdi_wage_base']
+        self.medicare_rate = table['fica']['medicare_rate']
+        self.additional_medicare_rate = table['fica']['additional_medicare_rate']
+        self.additional_medicare_threshold = federal['additional_medicare_threshold'] / 12
+        self.state_income_tax_rate = table['state'][state]['income_tax_rate']
+        self.famli_rate = table['state'][state]['famli_rate']
+
+@functools.lru_cache(maxsize=None)
+def load_tax_table(year=2023, filing_status="married_filing_jointly", state="colorado"):
+    """Load and precompute the tax table for a year, filing status and state once per process
+
+    Raises ValueError naming the available choices when there is no table for them.
+    """
+    years = sorted(f[:-4] for f in os.listdir(TAX_TABLE_DIR) if f.endswith('.yml'))
+    if str(year) not in years:
+        raise ValueError("No tax table for {}, available years: {}".format(year, ", ".join(years)))
+    with open(os.path.join(TAX_TABLE_DIR, "{}.yml".format(year)), 'r') as yml:
+        table = yaml.safe_load(yml)
+    if filing_status not in table['federal']:
+        raise ValueError("Unknown filing status '{}', expected one of: {}".format(
+                         filing_status, ", ".join(table['federal'])))
+    if state not in table['state']:
+        raise ValueError("No {} tax table for state '{}', available states: {}".format(
+                         year, state, ", ".join(table['state'])))
+    return TaxTable(year, filing_status, state, table)
+
+def compute_taxes(table, income, wages=None, self_employed=None, dependents=1):
+    """Compute monthly taxes for an array of monthly gross incomes in one vectorized pass
+
+    wages holds the earned income items with shape income.shape + (k,) and defaults to treating
+    the whole income as a single wage. self_employed is a boolean mask of length k marking
+    business income, which pays both halves of FICA.
+    """
+    income = np.asarray(income, dtype=float)
+    wages = income[..., np.newaxis] if wages is None else np.asarray(wages, dtype=float)
+
+    # Federal income tax from the marginal bracket of the taxable income
+    taxable_income = np.round(income - table.standard_deduction, 2)
+    bracket = np.searchsorted(table.thresholds, taxable_income, side='left')
+    federal = (taxable_income - table.lower_bounds[bracket]) * table.rates[bracket] + \
+              table.base_amounts[bracket] - dependents * table.child_tax_credit
+
+    # State income tax and FAMLI premium
+    state = income * table.state_income_tax_rate
+    famli = np.minimum(income, table.oasdi_wage_base) / 12 * table.famli_rate
+
+    # FICA taxes on each wage, with the additional Medicare tax prorated above the threshold
+    oasdi = np.round(np.minimum(wages, table.oasdi_wage_base / 12) * table.oasdi_rate, 2)
+    over = income > table.additional_medicare_threshold
+    extra_ratio = np.divide(income - table.additional_medicare_threshold, income,
+                            out=np.zeros_like(income), where=over)
+    medicare = np.round(wages * table.medicare_rate +
+                        wages * extra_ratio[..., np.newaxis] * table.additional_medicare_rate, 2)
+    if self_employed is not None:
+        factor = np.where(np.asarray(self_employed, dtype=bool), 2, 1)
+        oasdi = oasdi * factor
+        medicare = medicare * factor
+
+    return {
+        "taxable_income": taxable_income,
+        "high_tax_rate": table.rates[bracket],
+        "federal": federal,
+        "state": state,
+        "famli": famli,
+        "oasdi": oasdi,
+        "medicare": medicare,
+        "oasdi_total": oasdi.sum(axis=-1),
+        "medicare_total": medicare.sum(axis=-1),
+    }
@@ -0,0 +1,65 @@
+import json
+import pytest
+
+from budget_history import HistoryStore, parse_month
+
+def budget(groceries, rent=1000.0):
+    return {"monthly_budget": {"expenses": {"food": {"groceries": groceries}, "home": {"rent": rent}}}}
+
+def test_parse_month():
+    assert parse_month("2023-01") == "2023-01"
+    assert parse_month("2023-1") == "2023-01"
+    for bad in ("budget.", "2023-13", "2023/01", "", "01-2023"):
+        with pytest.raises(ValueError):
+            parse_month(bad)
+
+def test_rejects_bad_months(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append("2023-01", budget(100))
+    with pytest.raises(ValueError):
+        store.append("budget.", budget(200))
+    reopened = HistoryStore(str(tmp_path))
+    assert reopened.months == ["2023-01"]
+    assert reopened.trends()["month"] == "2023-01"
+
+def test_back_filled_months_stay_in_calendar_order(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    for month, groceries in (("2023-1", 100), ("2023-10", 1000), ("2023-2", 200)):
+        store.append(month, budget(groceries))
+    # A later month with a new line item widens the matrix
+    store.append("2022-12", {"monthly_budget": {"expenses": {"food": {"groceries": 50, "dining": 25}}}})
+    reopened = HistoryStore(str(tmp_path))
+    assert reopened.months == ["2022-12", "2023-01", "2023-02", "2023-10"]
+    assert reopened.category("expenses.food").tolist() == [7500, 10000, 20000, 100000]
+    with open(tmp_path / "meta.json") as f:
+        assert json.load(f)["months"] == reopened.months
+
+def test_replacing_a_month(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append("2023-01", budget(100))
+    store.append("2023-02", budget(200))
+    store.append("2023-01", budget(150))
+    assert HistoryStore(str(tmp_path)).category("expenses.food").tolist() == [15000, 20000]
+
+def test_calendar_fills_gap_months(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append("2022-11", budget(100))
+    store.append("2023-02", budget(300))
+    amounts = store.calendar("2023-02", 12)
+    # Cut short at the first stored month, with zero rows for December and January
+    assert store.category("expenses.food", amounts).tolist() == [10000, 0, 0, 30000]
+    assert store.category("expenses.food", store.calendar("2023-01", 2)).tolist() == [0, 0]
+
+def test_trends_use_calendar_months(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append("2022-01", budget(100))
+    store.append("2023-01", budget(200))
+    trends = store.trends("2023-01")
+    food = next(c for c in trends["categories"] if c["name"] == "Food")
+    assert trends["months"] == 12
+    assert food["amount"] == 200.0
+    # December 2022 has no budget, and January 2022 is outside the trailing twelve months
+    assert food["change"] == 200.0
+    assert food["trailing_12"] == 200.0
+    assert food["rolling_mean"] == pytest.approx(200.0 / 3)
+    assert store.trends("2021-12") is None
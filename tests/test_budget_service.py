@@ -0,0 +1,66 @@
+import os
+import sys
+import json
+import asyncio
+import yaml
+
+from budget_service import BudgetService
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from generate_budget import generate_budget
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "budget_sheet_template.yml")
+
+async def request(socket, path, body):
+    reader, writer = await asyncio.open_unix_connection(socket)
+    writer.write("POST {} HTTP/1.1\r\nContent-Length: {}\r\n\r\n".format(path, len(body)).encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), payload
+
+async def exercise(socket):
+    with open(TEMPLATE, 'rb') as f:
+        template = f.read()
+    # Large enough that its analysis outlasts the timeout below
+    slow = yaml.dump(generate_budget(items=50000, depth=3), Dumper=getattr(yaml, "CSafeDumper", yaml.SafeDumper)).encode()
+    service = BudgetService(workers=1, max_pending=1, timeout=0.2)
+    await service.start()
+    server = await asyncio.start_unix_server(service.handle, path=socket)
+    statuses = {}
+    try:
+        async with server:
+            service.timeout = 60.0
+            statuses["ok"], body = await request(socket, "/analytics?name=Template", template)
+            statuses["net_gain_loss"] = json.loads(body)["net_gain_loss"]
+            statuses["bad"], _ = await request(socket, "/analytics", b"- just\n- a list\n")
+            statuses["bad_year"], statuses["bad_year_body"] = await request(socket, "/analytics?tax_year=1999", template)
+            statuses["bad_state"], _ = await request(socket, "/analytics?state=atlantis", template)
+            statuses["sankey"], statuses["sankey_body"] = await request(socket, "/sankey", template)
+            service.timeout = 0.2
+            statuses["timeout"], _ = await request(socket, "/analytics", slow)
+            # The abandoned analysis still occupies the only worker, so the next request is turned away
+            statuses["busy"], _ = await request(socket, "/analytics", template)
+            for _ in range(600):
+                if not service.slots.locked():
+                    break
+                await asyncio.sleep(0.1)
+            service.timeout = 60.0
+            statuses["recovered"], _ = await request(socket, "/analytics", template)
+    finally:
+        service.close()
+    return statuses
+
+def test_service_statuses(tmp_path):
+    statuses = asyncio.run(exercise(str(tmp_path / "budget.sock")))
+    assert statuses["ok"] == 200
+    assert isinstance(statuses["net_gain_loss"], float)
+    assert statuses["bad"] == 400
+    assert statuses["bad_year"] == 400 and statuses["bad_state"] == 400
+    assert b"tax_tables" not in statuses["bad_year_body"]
+    assert statuses["sankey"] == 200
+    assert len(statuses["sankey_body"]) < 1024 * 1024
+    assert statuses["timeout"] == 504
+    assert statuses["busy"] == 503
+    assert statuses["recovered"] == 200
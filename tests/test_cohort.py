@@ -0,0 +1,67 @@
+import math
+import random
+import pytest
+
+from cohort import QuantileSketch
+
+def exact_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[int(math.floor(q * (len(ordered) - 1)))]
+
+def sketch_of(values, relative_accuracy=0.01, max_buckets=2048):
+    sketch = QuantileSketch(relative_accuracy, max_buckets)
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+def test_quantiles_within_relative_accuracy():
+    rng = random.Random(1)
+    values = [rng.lognormvariate(8, 1.5) for _ in range(5000)] + \
+             [-rng.lognormvariate(3, 1) for _ in range(500)] + [0.0] * 50
+    sketch = sketch_of(values)
+    for q in (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99):
+        exact = exact_quantile(values, q)
+        assert sketch.quantile(q) == pytest.approx(exact, rel=0.01, abs=1e-12)
+    assert sketch.count == len(values)
+    assert sketch.total == pytest.approx(sum(values))
+
+def test_quantiles_stay_within_min_and_max():
+    # Identical budgets give one value, whose bucket's representative lies on either side of it
+    for value in (0.105712, 7.0, -3.3, 1234.56):
+        sketch = sketch_of([value] * 3)
+        summary = sketch.summary((5, 25, 50, 75, 95))
+        assert all(summary[p] == value for p in ("p5", "p25", "p50", "p75", "p95"))
+        assert summary["min"] == summary["max"] == value
+
+def test_merge_matches_a_single_sketch():
+    rng = random.Random(2)
+    values = [rng.uniform(-50, 5000) for _ in range(3000)]
+    whole = sketch_of(values)
+    merged = sketch_of(values[:1000]).merge(sketch_of(values[1000:2200])).merge(sketch_of(values[2200:]))
+    assert merged.positive == whole.positive
+    assert merged.negative == whole.negative
+    assert (merged.zeros, merged.count, merged.min, merged.max) == (whole.zeros, whole.count, whole.min, whole.max)
+    for q in (0.05, 0.5, 0.95):
+        assert merged.quantile(q) == whole.quantile(q)
+
+def test_merge_rejects_other_accuracy():
+    with pytest.raises(ValueError):
+        QuantileSketch(0.01).merge(QuantileSketch(0.02))
+
+def test_collapse_bounds_buckets_and_keeps_upper_quantiles():
+    values = [1.01 ** i for i in range(2000)]
+    sketch = sketch_of(values, max_buckets=100)
+    assert len(sketch.positive) <= 100
+    assert sketch.count == len(values)
+    # Collapsing folds the buckets nearest zero, so the upper quantiles keep their accuracy
+    for q in (0.95, 0.99):
+        assert sketch.quantile(q) == pytest.approx(exact_quantile(values, q), rel=0.01)
+    merged = sketch_of(values[:1000], max_buckets=100).merge(sketch_of(values[1000:], max_buckets=100))
+    assert len(merged.positive) <= 100
+    assert merged.quantile(0.99) == pytest.approx(exact_quantile(values, 0.99), rel=0.01)
+
+def test_ignores_missing_values():
+    sketch = sketch_of([None, float("nan"), float("inf"), 5.0])
+    assert sketch.count == 1
+    assert sketch.quantile(0.5) == 5.0
+    assert QuantileSketch().quantile(0.5) is None
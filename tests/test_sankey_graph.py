@@ -0,0 +1,68 @@
+from sankey_graph import SankeyGraph
+
+def build(links):
+    graph = SankeyGraph()
+    for source, target, value in links:
+        graph.add_link(source, target, value, "rgba(255,0,0,0.3)")
+    return graph
+
+def labelled(graph):
+    labels = graph.node_labels
+    return [(labels[s], labels[t], v) for s, t, v in zip(graph.link_source, graph.link_target, graph.link_value)]
+
+def test_nodes_are_indexed_once():
+    graph = build([("Salary", "Income", 100.0), ("Income", "Expenses", 60.0), ("Income", "Savings", 40.0)])
+    assert graph.node_labels == ["Salary", "Income", "Expenses", "Savings"]
+    assert graph.node("Income") == 1
+    assert len(graph) == 3
+    links = graph.links()
+    assert links["source"] == [0, 1, 1]
+    assert links["target"] == [1, 2, 3]
+    assert links["value"] == [100.0, 60.0, 40.0]
+    assert links["color"] == ["rgba(255,0,0,0.3)"] * 3
+    assert graph.colors == ["rgba(255,0,0,0.3)"]
+
+def test_depths_values_and_layout():
+    graph = build([("Salary", "Income", 100.0), ("Income", "Expenses", 60.0), ("Income", "Savings", 40.0),
+                   ("Expenses", "Rent", 60.0)])
+    assert list(graph.node_depths()) == [0, 1, 2, 2, 3]
+    assert graph.node_values() == [100.0, 100.0, 60.0, 40.0, 60.0]
+    node_x, node_y = graph.layout()
+    assert node_x[0] == 0.001 and node_x[4] == 0.999
+    assert all(0.001 <= y <= 0.999 for y in node_y)
+    assert node_y[2] < node_y[3]
+
+def test_reduce_folds_small_branches():
+    graph = build([("Income", "Expenses", 1000.0)] +
+                  [("Expenses", "Item {}".format(i), value) for i, value in enumerate([500, 300, 100, 60, 40])])
+    reduced = graph.reduce(top_n=2)
+    assert labelled(reduced) == [("Income", "Expenses", 1000.0), ("Expenses", "Item 0", 500.0),
+                                 ("Expenses", "Item 1", 300.0), ("Expenses", "Other Expenses", 200.0)]
+    assert ("Expenses", "Other Expenses", 100.0) in labelled(graph.reduce(min_share=0.07))
+    assert sum(v for s, t, v in labelled(graph.reduce(min_share=0.07)) if s == "Expenses") == 1000.0
+
+def test_reduce_folds_inflows():
+    graph = build([("Salary {}".format(i), "Earned Income", value) for i, value in enumerate([900, 50, 30, 20])] +
+                  [("Earned Income", "Income", 1000.0)])
+    assert labelled(graph.reduce(top_n=1)) == [("Salary 0", "Earned Income", 900.0),
+                                               ("Other Earned Income", "Earned Income", 100.0),
+                                               ("Earned Income", "Income", 1000.0)]
+
+def test_reduce_without_folds_returns_graph():
+    graph = build([("Income", "Expenses", 100.0), ("Expenses", "Rent", 60.0), ("Expenses", "Food", 40.0)])
+    assert graph.reduce() is graph
+    # Folding a single branch would only rename it
+    assert graph.reduce(top_n=1) is graph
+
+def test_reduce_keeps_hub_branches():
+    graph = build([("Salary", "Income", 100.0), ("Interest", "Income", 1.0),
+                   ("Income", "Expenses", 99.0), ("Income", "Savings", 1.0), ("Income", "Taxes", 1.0)])
+    assert graph.reduce(top_n=1) is graph
+
+def test_other_label_does_not_collide():
+    graph = build([("Income", "Savings", 1000.0)] +
+                  [("Savings", label, value) for label, value in
+                   [("Emergency", 500), ("College", 300), ("Other Savings", 100), ("Gifts", 60), ("Travel", 40)]])
+    reduced = graph.reduce(top_n=2)
+    assert ("Savings", "Other Savings (3 items)", 200.0) in labelled(reduced)
+    assert "Other Savings" not in reduced.node_labels
@@ -0,0 +1,27 @@
+import os
+import sys
+import json
+import time
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules the analytics-only path must never import at startup
+RENDER_MODULES = ["plotly", "mako", "markdown", "pdfkit", "kaleido"]
+
+def test_import_is_lazy():
+    probe = "import sys, json; import budget_analyzer; " \
+            "print(json.dumps([m for m in {!r} if m in sys.modules]))".format(RENDER_MODULES)
+    result = subprocess.run([sys.executable, "-c", probe], cwd=ROOT, check=True, capture_output=True, text=True)
+    assert json.loads(result.stdout) == []
+
+def test_analytics_only_cli(tmp_path):
+    env = dict(os.environ, BUDGET_CACHE_DIR=str(tmp_path))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, os.path.join(ROOT, "budget_analyzer.py"), "-a",
+                             "-i", os.path.join(ROOT, "budget_sheet_template.yml")],
+                            cwd=tmp_path, env=env, check=True, capture_output=True, text=True, timeout=60)
+    # Generous, so the test only catches the rendering stack creeping back into the startup path
+    assert time.perf_counter() - start < 10
+    analytics = json.loads(result.stdout)
+    assert analytics["income"] == 10925.91
+    assert "net_gain_loss" in analytics
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from tax_engine import load_tax_table, compute_taxes
+
+def baseline_taxes(income, earned):
+    """The scalar 2023 married filing jointly and Colorado tax logic the tax engine replaced"""
+    joint_standard_deduction = 27700/12
+    joint_tax_lvls = [22000, 89450, 190750, 364200, 462500, 693750]
+    joint_tax_rates = [.1, .12, .22, .24, .32, .35, .37]
+    taxable_income = round(income - joint_standard_deduction, 2)
+    amounts = [joint_tax_lvls[0] * joint_tax_rates[0]]
+    for i in range(1, 6):
+        amounts.append((joint_tax_lvls[i] - joint_tax_lvls[i - 1]) * joint_tax_rates[i] + amounts[-1])
+    for i, level in enumerate(joint_tax_lvls):
+        if taxable_income <= level/12:
+            high_tax_rate = joint_tax_rates[i]
+            lower = joint_tax_lvls[i - 1]/12 if i else 0
+            federal = (taxable_income - lower) * joint_tax_rates[i] + (amounts[i - 1]/12 if i else 0)
+            break
+    else:
+        high_tax_rate = joint_tax_rates[6]
+        federal = (taxable_income - joint_tax_lvls[5]/12) * joint_tax_rates[6] + amounts[5]/12
+    federal -= 2000/12
+
+    max_oasdi_amt = 160200
+    state = income * 0.0440
+    if income/12 < max_oasdi_amt/12:
+        famli = (income/12) * 0.0045
+    else:
+        famli = (max_oasdi_amt/12) * 0.0045
+
+    oasdi, medicare = [], []
+    for name, value in earned.items():
+        oasdi_tax = round(value * 0.062, 2) if value < max_oasdi_amt/12 else round((max_oasdi_amt/12) * 0.062, 2)
+        if income <= 250000/12:
+            med_tax = round(value * 0.0145, 2)
+        else:
+            extra_ratio = (income - (250000/12)) / income
+            med_tax = round(value * 0.0145 + (value * extra_ratio) * 0.009, 2)
+        if "Salary" not in name and "Bonus" not in name:
+            oasdi_tax, med_tax = oasdi_tax * 2, med_tax * 2
+        oasdi.append(oasdi_tax)
+        medicare.append(med_tax)
+    return {"taxable_income": taxable_income, "high_tax_rate": high_tax_rate, "federal": round(federal, 2),
+            "state": round(state + famli, 2), "oasdi": oasdi, "medicare": medicare}
+
+EARNED = [
+    {"Name1 Salary": 6250.0, "Name1 Bonus": 300.0, "Name2 Salary": 4166.66, "Name2 Bonus": 200.0},
+    {"Name1 Salary": 1200.0},
+    {"Name1 Salary": 15000.0, "Consulting": 2500.0},
+    {"Name1 Salary": 24000.0, "Name2 Salary": 18000.0, "Rental Business": 9000.0},
+    {"Name1 Salary": 90000.0},
+]
+
+@pytest.mark.parametrize("earned", EARNED)
+@pytest.mark.parametrize("passive", [0.0, 9.25, 1500.0])
+def test_matches_baseline(earned, passive):
+    income = round(sum(earned.values()) + passive, 2)
+    expected = baseline_taxes(income, earned)
+    table = load_tax_table(2023, "married_filing_jointly", "colorado")
+    self_employed = ["Salary" not in name and "Bonus" not in name for name in earned]
+    taxes = compute_taxes(table, np.array(income), list(earned.values()), self_employed)
+    assert float(taxes["taxable_income"]) == expected["taxable_income"]
+    assert float(taxes["high_tax_rate"]) == expected["high_tax_rate"]
+    assert round(float(taxes["federal"]), 2) == expected["federal"]
+    assert round(float(taxes["state"] + taxes["famli"]), 2) == expected["state"]
+    assert taxes["oasdi"].tolist() == pytest.approx(expected["oasdi"], abs=1e-9)
+    assert taxes["medicare"].tolist() == pytest.approx(expected["medicare"], abs=1e-9)
+
+def test_vectorized_rows_match_scalar():
+    table = load_tax_table(2023, "married_filing_jointly", "colorado")
+    incomes = np.array([1000.0, 8000.0, 30000.0, 70000.0])
+    batch = compute_taxes(table, incomes)
+    for i, income in enumerate(incomes):
+        single = compute_taxes(table, np.array(income))
+        assert float(batch["federal"][i]) == pytest.approx(float(single["federal"]))
+        assert float(batch["medicare_total"][i]) == pytest.approx(float(single["medicare_total"]))
@@ -0,0 +1,84 @@
+from transaction_ingest import RuleTable, Transaction, read_csv, read_ofx, ingest
+
+OFX = """OFXHEADER:100
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>CREDIT
+<DTPOSTED>20230131120000
+<TRNAMT>5000.00
+<NAME>ACME PAYROLL
+<MEMO>Direct Dep
+</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20230203<TRNAMT>-42.17<NAME>SAFEWAY #123</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+RULES = {'rules': [{'pattern': 'payroll', 'category': 'income.earned_income.name1_salary', 'type': 'credit'},
+                   {'pattern': 'safeway', 'category': 'expenses.personal_expenses.groceries'},
+                   {'pattern': 'refund', 'category': 'income.passive_income.dividends', 'type': 'credit'}],
+         'default': 'expenses.personal_expenses.household_items'}
+
+def write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+def test_read_csv_iso_dates_and_amounts(tmp_path):
+    path = write(tmp_path, "export.csv", 'date,amount,description\n'
+                                         '2023-01-31,"1,234.50",Payroll\n'
+                                         '2023-02-01,$-12.00,Cafe\n')
+    assert list(read_csv(path)) == [Transaction('2023-01', 1234.5, 'Payroll'),
+                                    Transaction('2023-02', -12.0, 'Cafe')]
+
+def test_read_csv_custom_columns_and_date_format(tmp_path):
+    path = write(tmp_path, "export.csv", 'Date,Amount,Description\n12/31/2022,-5,Netflix\n')
+    transactions = read_csv(path, date='Date', amount='Amount', description='Description',
+                            date_format='%m/%d/%Y')
+    assert list(transactions) == [Transaction('2022-12', -5.0, 'Netflix')]
+
+def test_read_csv_timestamped_dates_through_small_memo(tmp_path):
+    # Every timestamp is distinct, so the memo is cleared repeatedly and months must still be right
+    rows = ''.join('2023-{:02d}-01 10:00:{:02d},-1,Cafe\n'.format(i % 12 + 1, i % 60) for i in range(100))
+    path = write(tmp_path, "export.csv", 'date,amount,description\n' + rows)
+    transactions = list(read_csv(path, date_format='%Y-%m-%d %H:%M:%S', memo_size=8))
+    assert [t.month for t in transactions] == ['2023-{:02d}'.format(i % 12 + 1) for i in range(100)]
+
+def test_read_ofx_multiline_and_single_line_records(tmp_path):
+    path = write(tmp_path, "export.ofx", OFX)
+    assert list(read_ofx(path)) == [Transaction('2023-01', 5000.0, 'ACME PAYROLL Direct Dep'),
+                                    Transaction('2023-02', -42.17, 'SAFEWAY #123')]
+
+def test_rule_table_first_match_type_and_default():
+    rules = RuleTable(RULES['rules'], RULES['default'])
+    assert rules.match(Transaction('2023-01', 100.0, 'ACME Payroll')) == \
+        ('income', 'earned_income', 'name1_salary')
+    assert rules.match(Transaction('2023-01', -3.0, 'safeway store')) == \
+        ('expenses', 'personal_expenses', 'groceries')
+    # A debit never matches a credit-only rule, so it falls through to the default
+    assert rules.match(Transaction('2023-01', -100.0, 'Payroll correction')) == \
+        ('expenses', 'personal_expenses', 'household_items')
+    assert RuleTable(RULES['rules']).match(Transaction('2023-01', -1.0, 'Unknown')) is None
+
+def test_rule_table_memo_stays_bounded():
+    rules = RuleTable(RULES['rules'], memo_size=4)
+    for i in range(20):
+        rules.match(Transaction('2023-01', -1.0, 'payee {}'.format(i)))
+        assert len(rules.memo) <= 4
+    assert rules.match(Transaction('2023-01', -1.0, 'Safeway')) == ('expenses', 'personal_expenses', 'groceries')
+
+def test_ingest_builds_monthly_budgets(tmp_path):
+    csv_path = write(tmp_path, "export.csv", 'date,amount,description\n'
+                                             '2023-01-05,-20.00,Safeway\n'
+                                             '2023-01-06,5.00,Safeway refund\n'
+                                             '2023-02-01,-7.50,Hardware\n')
+    ofx_path = write(tmp_path, "export.ofx", OFX)
+    skeleton = {'income': {'earned_income': {'name1_salary': 1.0}}}
+    budgets = ingest([csv_path, ofx_path], RULES, skeleton)
+    assert sorted(budgets) == ['2023-01', '2023-02']
+    january = budgets['2023-01']['monthly_budget']
+    assert january['income']['earned_income']['name1_salary'] == 5000.0
+    # Withdrawals add to spending, and a refund not claimed by a credit rule reduces it
+    assert january['expenses']['personal_expenses']['groceries'] == 15.0
+    february = budgets['2023-02']['monthly_budget']
+    assert february['income']['earned_income']['name1_salary'] == 0.0
+    assert february['expenses']['personal_expenses'] == {'groceries': 42.17, 'household_items': 7.5}
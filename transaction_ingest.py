@@ -0,0 +1,144 @@
+import os
+import re
+import csv
+import argparse
+from collections import namedtuple
+from datetime import datetime
+import yaml
+
+Transaction = namedtuple('Transaction', ['month', 'amount', 'description'])
+
+OFX_TAG = re.compile(r'<(/?)(\w+)>([^<\r\n]*)')
+
+def read_csv(path, date='date', amount='amount', description='description', date_format=None,
+             memo_size=4096):
+    """Stream transactions from a CSV export one row at a time"""
+    months = {}
+    with open(path, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            posted = row[date].strip()
+            month = months.get(posted)
+            if month is None:
+                month = datetime.strptime(posted, date_format).strftime('%Y-%m') if date_format else posted[:7]
+                # Timestamped dates are distinct on nearly every row, so keep the memo bounded
+                if len(months) >= memo_size:
+                    months.clear()
+                months[posted] = month
+            yield Transaction(month, float(row[amount].replace(',', '').replace('$', '')), row[description])
+
+def read_ofx(path):
+    """Stream transactions from an OFX/QFX export, reading one line at a time"""
+    with open(path, 'r', errors='replace') as f:
+        fields = None
+        for line in f:
+            for closing, tag, value in OFX_TAG.findall(line):
+                tag = tag.upper()
+                if tag == 'STMTTRN':
+                    if not closing:
+                        fields = {}
+                    elif fields is not None:
+                        description = ' '.join(filter(None, (fields.get('NAME'), fields.get('MEMO'))))
+                        posted = fields['DTPOSTED']
+                        yield Transaction(posted[:4] + '-' + posted[4:6], float(fields['TRNAMT']), description)
+                        fields = None
+                elif fields is not None and not closing and value.strip():
+                    fields[tag] = value.strip()
+
+def read_transactions(paths, csv_fields=None):
+    """Chain transactions from CSV and OFX/QFX files, picking the reader by file extension"""
+    for path in paths:
+        if os.path.splitext(path)[1].lower() in ('.ofx', '.qfx'):
+            yield from read_ofx(path)
+        else:
+            yield from read_csv(path, **(csv_fields or {}))
+
+class RuleTable():
+    """Ordered pattern rules mapping transaction descriptions onto budget item paths"""
+    def __init__(self, rules, default=None, memo_size=4096):
+        self.rules = [(re.compile(rule['pattern'], re.IGNORECASE), rule.get('type'),
+                       tuple(rule['category'].split('.'))) for rule in rules]
+        self.default = tuple(default.split('.')) if default else None
+        self.memo = {}
+        self.memo_size = memo_size
+
+    def match(self, transaction):
+        """Budget item path of the first rule matching a transaction, or the default path"""
+        kind = 'credit' if transaction.amount >= 0 else 'debit'
+        key = (transaction.description, kind)
+        category = self.memo.get(key, False)
+        if category is False:
+            category = self.default
+            for pattern, rule_kind, path in self.rules:
+                if (rule_kind is None or rule_kind == kind) and pattern.search(transaction.description):
+                    category = path
+                    break
+            # Ledgers repeat the same payees constantly, so memoize with a bounded table
+            if len(self.memo) >= self.memo_size:
+                self.memo.clear()
+            self.memo[key] = category
+        return category
+
+def categorize(transactions, rules):
+    """Pair each transaction with its budget item path, dropping unmatched transactions"""
+    for transaction in transactions:
+        category = rules.match(transaction)
+        if category is not None:
+            yield transaction, category
+
+def accumulate(categorized):
+    """Total amounts per month and budget item, in memory bounded by months x items"""
+    totals = {}
+    for transaction, category in categorized:
+        month = totals.setdefault(transaction.month, {})
+        # Deposits add to income, withdrawals add to spending and refunds reduce it
+        amount = transaction.amount if category[0] == 'income' else -transaction.amount
+        month[category] = month.get(category, 0.0) + amount
+    return totals
+
+def zeroed(dictionary):
+    """Copy of a budget tree with every amount set to zero"""
+    return {k: zeroed(v) if isinstance(v, dict) else 0.0 for k, v in dictionary.items()}
+
+def build_budgets(totals, skeleton=None):
+    """Turn per-month totals into the monthly_budget dicts MonthlyBudget consumes"""
+    budgets = {}
+    for month in sorted(totals):
+        tree = zeroed(skeleton) if skeleton else {}
+        for path, amount in totals[month].items():
+            node = tree
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            node[path[-1]] = round(node.get(path[-1], 0.0) + amount, 2)
+        budgets[month] = {'monthly_budget': tree}
+    return budgets
+
+def ingest(paths, config, skeleton=None):
+    """Stream transaction files through the rule table into one budget per month"""
+    rules = RuleTable(config['rules'], config.get('default'))
+    transactions = read_transactions(paths, config.get('csv'))
+    return build_budgets(accumulate(categorize(transactions, rules)), skeleton)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', type=str, nargs='+', required=True,
+                        help="CSV or OFX/QFX transaction exports")
+    parser.add_argument('-r', '--rules', type=str, required=True,
+                        help="YAML rule table mapping transactions onto budget items")
+    parser.add_argument('-s', '--skeleton', type=str, default="budget_sheet_template.yml",
+                        help="Budget sheet whose items are always present in the output, with zero amounts")
+    parser.add_argument('-o', '--output', type=str, default=".",
+                        help="Output directory for the <YYYY-MM>_budget.yml files")
+    args = parser.parse_args()
+
+    with open(args.rules, 'r') as yml:
+        config = yaml.safe_load(yml)
+    skeleton = None
+    if args.skeleton:
+        with open(args.skeleton, 'r') as yml:
+            skeleton = yaml.safe_load(yml)['monthly_budget']
+    os.makedirs(args.output, exist_ok=True)
+    for month, budget in ingest(args.input, config, skeleton).items():
+        budget_file = os.path.join(args.output, month + "_budget.yml")
+        with open(budget_file, 'w') as yml:
+            yaml.safe_dump(budget, yml, sort_keys=False)
+        print("INFO: Wrote {}".format(budget_file))